@@ -1,61 +1,184 @@
+import itertools
+import json
+import multiprocessing
 import sys
+from pathlib import Path
 
 import click
 import cligj
+import numpy as np
 
-try:
-    import schedule_tile_pb2
-except ImportError:
-    msg = 'Protobuf python code not generated'
-    raise ImportError(msg)
+# The ScheduleTile encoder is shared with the tiling scripts in code/tile
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'tile'))
+import schedule_tile_pbf  # noqa: E402
 
 
 @click.command()
 @cligj.features_in_arg
-def main(features):
+@click.option(
+    '-d',
+    '--tile-dir',
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    required=False,
+    default=None,
+    help=
+    'Root of directory with newline-delimited GeoJSON tiles. If provided, all tiles of the given zooms are converted instead of reading features from stdin.'
+)
+@click.option(
+    '-o',
+    '--pbf-dir',
+    type=click.Path(file_okay=False, dir_okay=True, writable=True),
+    required=False,
+    default=None,
+    help='Root of directory to write gzipped PBF tiles to, with --tile-dir')
+@click.option(
+    '-z',
+    '--zoom',
+    type=int,
+    multiple=True,
+    help='Zoom level to convert with --tile-dir. Can be provided multiple times.'
+)
+@click.option(
+    '-j',
+    '--workers',
+    type=int,
+    default=multiprocessing.cpu_count(),
+    show_default=True,
+    help='Number of worker processes used with --tile-dir')
+@click.option(
+    '--time-bucket-minutes',
+    type=int,
+    required=False,
+    default=None,
+    help=
+    'With --tile-dir, split each tile into buckets of this many minutes by the time of the first vertex of each feature, written to `{pbf-dir}/{bucket start in seconds}/{z}/{x}/{y}.pbf`.'
+)
+def main(features, tile_dir, pbf_dir, zoom, workers, time_bucket_minutes):
     """Convert ScheduleStopPair GeoJSON LineStrings to PBF
+
+    By default, reads features from stdin and writes a single uncompressed
+    ScheduleTile to stdout. With --tile-dir, converts every tile of the given
+    zooms to `{pbf-dir}/{z}/{x}/{y}.pbf`, gzipped, in a single process pool.
     """
-    # Instantiate objects
-    # The `length` Deck.GL is expecting is the total number of coordinates, not
-    # number of features
-    positions = []
-    timestamps = []
-    indices = [0]
-    index = 0
-    n_coords = 0
-
-    # Loop over features from stdin
-    for feature in features:
-        feature_type = feature['type']
-        assert feature_type == 'Feature', 'top-level obj should be Feature'
-        geom_type = feature['geometry']['type']
-        assert geom_type == 'LineString', 'geometry must be LineString'
-
-        coords = feature['geometry']['coordinates']
-        for coord in coords:
-            positions.extend(coord[:2])
-            timestamps.append(coord[2])
-            index += 1
-            n_coords += 1
-
-        indices.append(index)
-
-    # Minimal validation
-    msg = 'should be 2x positions for each timestamp'
-    assert len(positions) == 2 * len(timestamps), msg
-    msg = 'incorrect # of indices'
-    assert indices[-1] == n_coords, msg
-
-    # Create tile
-    schedule_tile = schedule_tile_pb2.ScheduleTile()
-    schedule_tile.positions.extend(positions)
-    schedule_tile.timestamps.extend(timestamps)
-    schedule_tile.startIndices.extend(indices)
-    schedule_tile.length = n_coords
+    if tile_dir:
+        if not pbf_dir or not zoom:
+            raise click.UsageError(
+                '--pbf-dir and --zoom are required with --tile-dir')
+
+        bucket_seconds = None
+        if time_bucket_minutes:
+            bucket_seconds = time_bucket_minutes * 60
+        convert_tiles(
+            Path(tile_dir), Path(pbf_dir), zoom, workers, bucket_seconds)
+        return
+
+    coords_list = [feature_coords(feature) for feature in features]
 
     # Write to stdout
     # https://stackoverflow.com/a/908440
-    sys.stdout.buffer.write(schedule_tile.SerializeToString())
+    sys.stdout.buffer.write(encode_schedule_tile(coords_list))
+
+
+def feature_coords(feature):
+    """List of lon, lat, time coordinates of LineString feature"""
+    feature_type = feature['type']
+    assert feature_type == 'Feature', 'top-level obj should be Feature'
+    geom_type = feature['geometry']['type']
+    assert geom_type == 'LineString', 'geometry must be LineString'
+
+    coords = feature['geometry']['coordinates']
+    assert set(map(len, coords)) <= {3}, 'coordinates must have 3 dimensions'
+    return coords
+
+
+def coords_array(coords_list):
+    """Array of shape (n, 3) of the coordinates of all LineStrings
+
+    np.fromiter over the flattened values is much faster than np.array on
+    nested lists, and avoids looping over coordinates in Python.
+
+    Args:
+        - coords_list: list of lists of [lon, lat, time] coordinates
+    """
+    n_coords = sum(map(len, coords_list))
+    values = itertools.chain.from_iterable(
+        itertools.chain.from_iterable(coords_list))
+    return np.fromiter(
+        values, dtype=np.float64, count=3 * n_coords).reshape(-1, 3)
+
+
+def encode_schedule_tile(coords_list):
+    """Encode ScheduleTile message from coordinates of LineStrings
+
+    Coordinates are copied into NumPy arrays with coords_array, and encoded
+    with `schedule_tile_pbf.encode_schedule_tile`. The output is the same as
+    `ScheduleTile.SerializeToString()`.
+
+    Args:
+        - coords_list: list of lists of [lon, lat, time] coordinates
+
+    Returns:
+        bytes
+    """
+    coords = coords_array(coords_list)
+
+    # The `length` Deck.GL is expecting is the total number of coordinates, not
+    # number of features
+    start_indices = np.zeros(len(coords_list) + 1, dtype=np.uint64)
+    np.cumsum(list(map(len, coords_list)), out=start_indices[1:])
+
+    return schedule_tile_pbf.encode_schedule_tile(
+        coords[:, :2].ravel(), coords[:, 2], start_indices)
+
+
+def convert_tiles(tile_dir, pbf_dir, zooms, workers, bucket_seconds=None):
+    """Convert GeoJSON tiles of given zooms to gzipped PBF tiles"""
+    tasks = []
+    for zoom in zooms:
+        for path in (tile_dir / str(zoom)).glob('*/*.geojson'):
+            relative_path = (
+                Path(str(zoom)) / path.parent.name / f'{path.stem}.pbf')
+            tasks.append((path, pbf_dir, relative_path, bucket_seconds))
+
+    # Create directories once, before starting workers. Directories of time
+    # buckets aren't known until tiles are read, so workers create those.
+    if not bucket_seconds:
+        for out_dir in {pbf_dir / rel.parent for _, _, rel, _ in tasks}:
+            out_dir.mkdir(parents=True, exist_ok=True)
+
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(workers) as pool:
+        for _ in pool.imap_unordered(convert_tile, tasks, chunksize=16):
+            pass
+
+    print(f'Converted {len(tasks)} tiles', file=sys.stderr)
+
+
+def convert_tile(task):
+    """Convert a single GeoJSON tile to gzipped PBF tiles
+
+    Without time buckets, writes `{pbf_dir}/{z}/{x}/{y}.pbf`. Otherwise,
+    writes one tile per bucket with features, to
+    `{pbf_dir}/{bucket}/{z}/{x}/{y}.pbf`.
+    """
+    path, pbf_dir, relative_path, bucket_seconds = task
+    with open(path) as f:
+        coords_list = [
+            feature_coords(json.loads(line)) for line in f if line.strip()]
+
+    groups = schedule_tile_pbf.group_by_time_bucket(coords_list, bucket_seconds)
+    for bucket, bucket_coords_list in groups.items():
+        out_path = schedule_tile_pbf.bucket_dir(pbf_dir, bucket) / relative_path
+        # Directories of tiles without buckets are created by convert_tiles
+        if bucket is not None:
+            out_path.parent.mkdir(parents=True, exist_ok=True)
+        write_tile(out_path, bucket_coords_list)
+
+
+def write_tile(out_path, coords_list):
+    """Write coordinates of LineStrings as a gzipped ScheduleTile"""
+    schedule_tile_pbf.write_gzipped(
+        out_path, encode_schedule_tile(coords_list))
 
 
 if __name__ == '__main__':
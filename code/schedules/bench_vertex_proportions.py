@@ -0,0 +1,108 @@
+"""
+bench_vertex_proportions.py: Micro-benchmark of per-vertex time interpolation
+
+Compares the original approach in `ssp_geom.py`, which calls
+`line.project(Point(coord), normalized=True)` for every vertex, against
+`ssp_geom.vertex_proportions`, which uses cumulative segment lengths in a
+single NumPy pass.
+
+By default a synthetic rail line is used. Pass `--rsp-path` to benchmark the
+longest RouteStopPattern in a newline-delimited GeoJSON file instead, e.g.
+```
+python code/schedules/bench_vertex_proportions.py \
+    --rsp-path data/rsp/route_stop_patterns.geojson
+```
+"""
+import json
+import math
+import timeit
+
+import click
+import numpy as np
+from shapely.geometry import LineString, Point, shape
+
+from ssp_geom import iter_file, vertex_proportions
+
+
+@click.command()
+@click.option(
+    '--rsp-path',
+    type=click.Path(exists=True, dir_okay=False, file_okay=True, readable=True),
+    required=False,
+    default=None,
+    help='Path to GeoJSON file with Transit.land route_stop_patterns')
+@click.option(
+    '-n',
+    '--n-vertices',
+    type=int,
+    default=2000,
+    show_default=True,
+    help='Number of vertices of synthetic line, if --rsp-path not given')
+@click.option(
+    '-r',
+    '--repeat',
+    type=int,
+    default=5,
+    show_default=True,
+    help='Number of timing repetitions; the best is reported')
+def main(rsp_path, n_vertices, repeat):
+    """Benchmark old vs new vertex proportion computation
+    """
+    if rsp_path:
+        line = load_longest_line(rsp_path)
+    else:
+        line = synthetic_rail_line(n_vertices)
+
+    n = len(line.coords)
+    print(f'Line with {n} vertices')
+
+    old = old_vertex_proportions(line)
+    new = vertex_proportions(np.asarray(line.coords)[:, :2])
+    max_diff = np.max(np.abs(np.array(old) - new))
+    print(f'Max absolute difference in proportions: {max_diff:.3g}')
+
+    old_time = min(
+        timeit.repeat(
+            lambda: old_vertex_proportions(line), number=1, repeat=repeat))
+    new_time = min(
+        timeit.repeat(
+            lambda: vertex_proportions(np.asarray(line.coords)[:, :2]),
+            number=1,
+            repeat=repeat))
+
+    print(f'project() per vertex: {old_time * 1000:.2f} ms')
+    print(f'vertex_proportions:   {new_time * 1000:.2f} ms')
+    print(f'Speedup: {old_time / new_time:.1f}x')
+
+
+def old_vertex_proportions(line):
+    """Original implementation from ssp_geom.match_ssp_to_route"""
+    proportions = []
+    for coord in line.coords:
+        proportion = line.project(Point(coord), normalized=True)
+        proportions.append(proportion)
+
+    return proportions
+
+
+def synthetic_rail_line(n_vertices):
+    """Gently curving line of roughly 1km per 50 vertices"""
+    coords = [(-122.4 + i * 2e-4, 37.7 + 5e-3 * math.sin(i / 50))
+              for i in range(n_vertices)]
+    return LineString(coords)
+
+
+def load_longest_line(path):
+    longest = None
+    for line in iter_file(path):
+        geom = shape(json.loads(line)['geometry'])
+        if geom.type != 'LineString':
+            continue
+        if longest is None or len(geom.coords) > len(longest.coords):
+            longest = geom
+
+    return longest
+
+
+if __name__ == '__main__':
+    main()
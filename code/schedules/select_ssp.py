@@ -1,7 +1,9 @@
 import json
+import re
 import sqlite3
 import sys
-from datetime import datetime
+from datetime import date, datetime
+from functools import lru_cache
 
 import click
 
@@ -14,7 +16,13 @@ import click
     required=True,
     help='Path to sqlite database with ScheduleStopPairs data')
 @click.option(
-    '--route-id', type=str, required=True, help='route_onestop_id to query for')
+    '--route-id',
+    type=str,
+    required=True,
+    multiple=True,
+    help=
+    'route_onestop_id to query for. May be given multiple times to select ScheduleStopPairs of several routes, ordered by route.'
+)
 @click.option(
     '-h',
     '--origin-departure-hour',
@@ -61,9 +69,16 @@ import click
     default=None,
     multiple=True,
     help='Extra columns to extract')
+@click.option(
+    '--explain',
+    is_flag=True,
+    default=False,
+    help=
+    'Print the SQLite query plan instead of running the query, and fail if the query would scan every row of the table.'
+)
 def main(
         sqlite_path, table_name, route_id, origin_departure_hour,
-        service_days_of_week, service_date, column):
+        service_days_of_week, service_date, column, explain):
     """Select ScheduleStopPairs from SQLite database
     """
     # Setting the row_factory attribute allows for creating dict-like objects
@@ -71,29 +86,68 @@ def main(
     conn = sqlite3.connect(sqlite_path)
     conn.row_factory = sqlite3.Row
 
-    query_str = generate_query(
+    query_str, params = generate_query(
         table_name=table_name,
         origin_departure_hour=origin_departure_hour,
         service_days_of_week=service_days_of_week,
         service_date=service_date,
         route_id=route_id,
         columns=column)
-    for record in run_query(conn, query_str):
+
+    if explain:
+        plan = explain_query(conn, query_str, params)
+        print('\n'.join(plan))
+        if not uses_index(plan, table_name):
+            raise click.ClickException(
+                f'Query scans every row of {table_name}. Have the indexes in code/ssp/ssp_derived_columns.sql been created?'
+            )
+        return
+
+    for record in run_query(conn, query_str, params):
         print(json.dumps(record, separators=(',', ':')))
 
 
-def run_query(conn, query_str):
+def run_query(conn, query_str, params=()):
     """Run SQLite query on database
 
     Args:
         - conn: SQLite connection
         - query_str: string to run in SQLite
+        - params: parameters bound to ? placeholders in query_str
     """
-    cursor = conn.execute(query_str)
+    cursor = conn.execute(query_str, params)
     for row in cursor:
         yield {k: row[k] for k in row.keys()}
 
 
+def explain_query(conn, query_str, params=()):
+    """Return SQLite query plan as list of strings
+
+    Args:
+        - conn: SQLite connection
+        - query_str: string to run in SQLite
+        - params: parameters bound to ? placeholders in query_str
+    """
+    cursor = conn.execute(f'EXPLAIN QUERY PLAN {query_str}', params)
+    return [row[-1] for row in cursor]
+
+
+def uses_index(plan, table_name):
+    """Check that a query plan doesn't scan every row of the table
+
+    Args:
+        - plan: list of strings from explain_query
+        - table_name: name of ScheduleStopPairs table
+    """
+    # SQLite before 3.36 prints `SCAN TABLE ssp`, later versions `SCAN ssp`
+    scan = re.compile(rf'SCAN (TABLE )?{re.escape(table_name)}\b')
+    for detail in plan:
+        if scan.match(detail) and 'INDEX' not in detail:
+            return False
+
+    return True
+
+
 def generate_query(
         table_name,
         origin_departure_hour=None,
@@ -103,37 +157,33 @@ def generate_query(
         columns=None):
     """Generate query for SQLite
 
-    Technically you should use ? in query strings that will be interpolated by
-    the DB API to avoid SQL injection attacks, but since this code is only run
-    locally I'll just use string interpolation.
-    """
-
-    # Define default column names
-    default_columns = [
-        'origin_onestop_id', 'destination_onestop_id', 'route_onestop_id',
-        'route_stop_pattern_onestop_id', 'origin_departure_time',
-        'destination_arrival_time', 'origin_dist_traveled',
-        'destination_dist_traveled']
+    Filters use the integer columns created by `code/ssp/ssp_derived_columns.sql`,
+    so that they can be satisfied by the (route_onestop_id,
+    origin_departure_seconds) index instead of parsing text on every row.
 
-    if columns:
-        assert type(columns) in [list, tuple], 'columns must be list or tuple'
-        default_columns.extend(columns)
+    Returns:
+        (query string, tuple of parameters to bind to its ? placeholders)
+    """
 
-    column_str = ', '.join(set(default_columns))
-    execute_str = f'SELECT {column_str} FROM {table_name} WHERE '
+    column_str = ', '.join(select_columns(columns))
+    execute_str = f'SELECT {column_str} FROM {table_name}'
 
     # Where clause
     where_clause = []
-    if route_id:
-        where_clause.append(f'route_onestop_id = "{route_id}"')
+    params = []
+    if isinstance(route_id, str):
+        route_id = [route_id]
 
-    if service_days_of_week:
-        day_strings = []
-        for day in service_days_of_week:
-            day_strings.append(f'service_days_of_week_{day} = "true"')
-
-        s = '(' + ' OR '.join(day_strings) + ')'
-        where_clause.append(s)
+    order_by = None
+    if route_id and len(route_id) > 1:
+        placeholders = ', '.join('?' for _ in route_id)
+        where_clause.append(f'route_onestop_id IN ({placeholders})')
+        params.extend(route_id)
+        # Keep each route's ScheduleStopPairs contiguous in the output
+        order_by = 'route_onestop_id'
+    elif route_id:
+        where_clause.append('route_onestop_id = ?')
+        params.append(route_id[0])
 
     if origin_departure_hour:
         msg = 'origin_departure_hour should have at most 2 elements'
@@ -143,28 +193,86 @@ def generate_query(
         assert all(isinstance(x, int) for x in origin_departure_hour), msg
 
         start = origin_departure_hour[0]
-        s = f'CAST(SUBSTR(origin_departure_time, 0, 3) AS INT) >= {start}'
-        where_clause.append(s)
+        where_clause.append('origin_departure_seconds >= ?')
+        params.append(start * 60 * 60)
 
         try:
             end = origin_departure_hour[1]
-            s = f'CAST(SUBSTR(origin_departure_time, 0, 3) AS INT) < {end}'
-            where_clause.append(s)
+            where_clause.append('origin_departure_seconds < ?')
+            params.append(end * 60 * 60)
         except IndexError:
             pass
 
+    if service_days_of_week:
+        where_clause.append('(service_days_of_week_mask & ?) != 0')
+        params.append(days_of_week_mask(service_days_of_week))
+
     if service_date:
         validate_date(service_date)
-        where_clause.append(
-            f'DATE("{service_date}") >= DATE(service_start_date)')
-        where_clause.append(f'DATE("{service_date}") < DATE(service_end_date)')
+        day = julian_day(service_date)
+        where_clause.append('service_start_julian <= ?')
+        params.append(day)
+        where_clause.append('service_end_julian > ?')
+        params.append(day)
 
-    execute_str += ' AND '.join(where_clause)
+    if where_clause:
+        execute_str += ' WHERE ' + ' AND '.join(where_clause)
+    if order_by:
+        execute_str += f' ORDER BY {order_by}'
     execute_str += ';'
 
     # Print query string to stderr
-    print(f'Query string:\n{execute_str}', file=sys.stderr)
-    return execute_str
+    print(f'Query string:\n{execute_str}\nParameters: {params}', file=sys.stderr)
+    return execute_str, tuple(params)
+
+
+def days_of_week_mask(days):
+    """Bitmask of days of week, where bit 0 is Monday
+
+    Args:
+        - days: iterable of int days of week, where 0 is Monday
+    """
+    mask = 0
+    for day in days:
+        assert 0 <= day <= 6, 'day of week must be between 0 and 6'
+        mask |= 1 << day
+
+    return mask
+
+
+@lru_cache(maxsize=None)
+def julian_day(date_text):
+    """Integer julian day of YYYY-MM-DD date, or None
+
+    Matches `CAST(JULIANDAY(date_text) AS INT)` in SQLite
+    """
+    if date_text is None:
+        return None
+
+    # JULIANDAY of midnight is x.5; date ordinals are offset by 1721424.5
+    return date.fromisoformat(date_text).toordinal() + 1721424
+
+
+def select_columns(columns=None):
+    """Columns selected by generate_query, in order
+
+    Args:
+        - columns: extra columns to select in addition to those needed to
+          match ScheduleStopPairs to geometries
+    """
+    # Define default column names
+    default_columns = [
+        'origin_onestop_id', 'destination_onestop_id', 'route_onestop_id',
+        'route_stop_pattern_onestop_id', 'origin_departure_time',
+        'destination_arrival_time', 'origin_dist_traveled',
+        'destination_dist_traveled']
+
+    if columns:
+        assert type(columns) in [list, tuple], 'columns must be list or tuple'
+        default_columns.extend(columns)
+
+    # Deduplicate while keeping order, so that rows can be read as tuples
+    return list(dict.fromkeys(default_columns))
 
 
 def validate_date(date_text):
@@ -10,17 +10,27 @@ So I think the process to get geometric ScheduleStopPairs is:
 5. Keep the `LineString` of the `RouteStopPattern` between the `origin` and `destination` coordinate
 6. For each coordinate of the `LineString` between `origin` and `destination`, linearly interpolate the timestamp between the origin timestamp and destination timestamp. Shouldn't have to simplify more because the geometry should already be simplified from transitland.
 """
+import gc
+import itertools
 import json
+import multiprocessing
 import re
+import sqlite3
 import sys
+from collections import OrderedDict, deque
+from functools import lru_cache
+from pathlib import Path
 
 import click
 import geojson
+import numpy as np
 import pyproj
 from haversine import Unit, haversine
 from shapely.geometry import LineString, Point, asShape, shape
 from shapely.ops import nearest_points, transform
 
+import select_ssp
+
 
 @click.command()
 @click.option(
@@ -47,23 +57,334 @@ from shapely.ops import nearest_points, transform
     default=[],
     required=False,
     help='Keys of properties to retain in outputted Features')
-@click.argument('ssp-records', type=click.File())
-def main(stops_path, routes_path, rsp_path, properties_keys, ssp_records):
+@click.option(
+    '-o',
+    '--output-dir',
+    type=click.Path(file_okay=False, dir_okay=True, writable=True),
+    required=False,
+    default=None,
+    help=
+    'Write features to `{route_id}.geojson` in this directory instead of stdout, and touch `{route_id}.finished` once done. Allows ScheduleStopPairs of many routes to be matched in one process, loading stops, routes and route stop patterns only once.'
+)
+@click.option(
+    '-j',
+    '--workers',
+    type=int,
+    required=False,
+    default=1,
+    show_default=True,
+    help=
+    'Number of worker processes. Stops, routes and route stop patterns are loaded once and shared with forked workers; ScheduleStopPairs are dispatched in chunks grouped by route, and output keeps the input order.'
+)
+@click.option(
+    '-f',
+    '--sqlite-path',
+    type=click.Path(exists=True, dir_okay=False, file_okay=True, readable=True),
+    required=False,
+    default=None,
+    help=
+    'Read ScheduleStopPairs directly from this sqlite database instead of SSP_RECORDS. Uses the same filters as select_ssp.py.'
+)
+@click.option(
+    '--table-name',
+    type=str,
+    required=False,
+    default='ssp',
+    show_default=True,
+    help='Name of ScheduleStopPairs table in the sqlite database')
+@click.option(
+    '--route-id',
+    type=str,
+    required=False,
+    multiple=True,
+    help='With --sqlite-path, route_onestop_id to query for. May be repeated.')
+@click.option(
+    '-h',
+    '--origin-departure-hour',
+    type=int,
+    required=False,
+    multiple=True,
+    help=
+    'With --sqlite-path, origin departure start hour and optional non-inclusive end hour. See select_ssp.py.'
+)
+@click.option(
+    '-d',
+    '--service-days-of-week',
+    type=int,
+    required=False,
+    multiple=True,
+    help=
+    'With --sqlite-path, day of week to select, where 0 is Monday. May be repeated.'
+)
+@click.option(
+    '--service-date',
+    type=str,
+    required=False,
+    default=None,
+    help='With --sqlite-path, date of service as YYYY-MM-DD.')
+@click.option(
+    '--tag-service',
+    is_flag=True,
+    default=False,
+    help=
+    'Add the service days bitmask, service date range and origin departure seconds of each ScheduleStopPair to its properties, so that code/tile/tile_geojson.py --windows-path can split all ScheduleStopPairs into time windows. Use without day, hour and date filters to match geometries once for every window.'
+)
+@click.argument('ssp-records', type=click.File(), required=False)
+def main(
+        stops_path, routes_path, rsp_path, properties_keys, output_dir,
+        workers, sqlite_path, table_name, route_id, origin_departure_hour,
+        service_days_of_week, service_date, tag_service, ssp_records):
+    if sqlite_path is None and ssp_records is None:
+        raise click.UsageError('Either SSP_RECORDS or --sqlite-path required')
+
     ssp_geom = ScheduleStopPairGeometry(
         stops_path=stops_path, routes_path=routes_path, rsp_path=rsp_path)
 
-    for ssp_line in ssp_records:
-        # Parse json
-        ssp = json.loads(ssp_line)
+    writer = None
+    if output_dir:
+        writer = RouteFileWriter(output_dir)
+
+    properties_keys = list(properties_keys)
+    if tag_service:
+        properties_keys.extend(SERVICE_TAG_KEYS)
+
+    if sqlite_path:
+        columns = select_ssp.select_columns(properties_keys)
+        query_str, params = select_ssp.generate_query(
+            table_name=table_name,
+            origin_departure_hour=origin_departure_hour,
+            service_days_of_week=service_days_of_week,
+            service_date=service_date,
+            route_id=route_id,
+            columns=properties_keys)
+        ssps = iter_sqlite_ssps(sqlite_path, query_str, params, columns)
+    else:
+        ssps = (json.loads(ssp_line) for ssp_line in ssp_records)
+        if tag_service:
+            ssps = (add_service_tags(ssp) for ssp in ssps)
+    if workers > 1:
+        results = match_in_pool(ssp_geom, ssps, properties_keys, workers)
+    else:
+        results = match_ssps(ssp_geom, ssps, properties_keys)
+
+    for route_id, line in results:
+        if writer:
+            writer.write(route_id, line)
+        else:
+            # Write to stdout
+            click.echo(line)
+
+    if writer:
+        writer.close()
+
+    ssp_geom.print_cache_stats()
+
+
+# Number of rows fetched from sqlite at once
+SQLITE_BATCH_SIZE = 10000
+
+# Properties added with --tag-service. These are the derived integer columns
+# of `code/ssp/ssp_derived_columns.sql`, which select_ssp.py filters on.
+SERVICE_TAG_KEYS = [
+    'service_days_of_week_mask', 'service_start_julian', 'service_end_julian',
+    'origin_departure_seconds']
+
+
+def add_service_tags(ssp):
+    """Add SERVICE_TAG_KEYS to a ScheduleStopPair record from JSON
+
+    Records from SSP_RECORDS have the raw Transit.land fields instead of the
+    derived columns of the sqlite database, so compute them the same way.
+    Raises ValueError if the record has no `service_days_of_week`, since it
+    would silently be left out of every window filtered on days of week.
+    """
+    days = ssp.get('service_days_of_week')
+    if days is None:
+        raise ValueError(
+            f'ScheduleStopPair of trip {ssp.get("trip")} has no '
+            'service_days_of_week to tag')
+
+    ssp['service_days_of_week_mask'] = select_ssp.days_of_week_mask(
+        day for day, in_service in enumerate(days) if in_service)
+    ssp['service_start_julian'] = select_ssp.julian_day(
+        ssp['service_start_date'])
+    ssp['service_end_julian'] = select_ssp.julian_day(ssp['service_end_date'])
+    ssp['origin_departure_seconds'] = time_str_to_seconds(
+        ssp['origin_departure_time'])
+    return ssp
+
+
+def iter_sqlite_ssps(sqlite_path, query_str, params, columns):
+    """Generator of ScheduleStopPairs read directly from sqlite
 
+    Rows are fetched in batches as plain tuples, avoiding the JSON round trip
+    through select_ssp.py.
+
+    Args:
+        - sqlite_path: path to sqlite database with ScheduleStopPairs data
+        - query_str: query from select_ssp.generate_query
+        - params: parameters from select_ssp.generate_query
+        - columns: selected columns, in order, from select_ssp.select_columns
+    """
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        cursor = conn.execute(query_str, params)
+        while True:
+            rows = cursor.fetchmany(SQLITE_BATCH_SIZE)
+            if not rows:
+                break
+
+            for row in rows:
+                yield dict(zip(columns, row))
+    finally:
+        conn.close()
+
+
+def match_ssps(ssp_geom, ssps, properties_keys):
+    """Match ScheduleStopPairs to geometries
+
+    Args:
+        - ssp_geom: ScheduleStopPairGeometry instance
+        - ssps: iterable of dicts representing ScheduleStopPair records
+        - properties_keys: iterable with keys to keep in the GeoJSON Feature
+          output.
+
+    Yields:
+        (route_id, serialized GeoJSON Feature) for each matched record
+    """
+    for ssp in ssps:
         # Construct GeoJSON Feature of ScheduleStopPair
         ssp_feature = ssp_geom.match_ssp_to_route(ssp, properties_keys)
 
         if ssp_feature is None:
             continue
 
-        # Write to stdout
-        click.echo(geojson.dumps(ssp_feature, separators=(',', ':')))
+        line = geojson.dumps(ssp_feature, separators=(',', ':'))
+        yield ssp['route_onestop_id'], line
+
+
+# Max number of ScheduleStopPairs sent to a worker at once
+SSP_CHUNK_SIZE = 5000
+
+# ScheduleStopPairGeometry inherited by forked worker processes
+WORKER_SSP_GEOM = None
+
+
+def match_in_pool(ssp_geom, ssps, properties_keys, workers):
+    """Match ScheduleStopPairs to geometries in a pool of forked processes
+
+    The reference data in `ssp_geom` is not pickled; workers inherit it
+    copy-on-write when forked. Results are yielded in input order.
+
+    Args:
+        - ssp_geom: ScheduleStopPairGeometry instance
+        - ssps: iterable of dicts representing ScheduleStopPair records
+        - properties_keys: iterable with keys to keep in the GeoJSON Feature
+          output.
+        - workers: number of worker processes
+    """
+    global WORKER_SSP_GEOM
+    WORKER_SSP_GEOM = ssp_geom
+
+    # Move the reference data out of the garbage collector's view, so that
+    # collections in the workers don't touch (and thereby copy) its pages
+    gc.freeze()
+
+    # Bound the number of chunks read ahead of the writer, since the pool
+    # would otherwise consume the whole input into memory. Chunks are only
+    # submitted from this thread, so an error in a worker is raised here and
+    # the pool is terminated.
+    max_pending = workers * 4
+    pending = deque()
+    chunks = iter_route_chunks(ssps, SSP_CHUNK_SIZE)
+
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(workers) as pool:
+        while True:
+            for chunk in itertools.islice(chunks, max_pending - len(pending)):
+                args = (chunk, properties_keys)
+                pending.append(pool.apply_async(match_chunk, (args, )))
+            if not pending:
+                break
+
+            lines, hits, misses = pending.popleft().get()
+            ssp_geom.cache_hits += hits
+            ssp_geom.cache_misses += misses
+            yield from lines
+
+
+def match_chunk(args):
+    """Match a chunk of ScheduleStopPairs in a worker process
+
+    Returns:
+        (list of (route_id, line), segment cache hits, segment cache misses)
+    """
+    ssps, properties_keys = args
+    ssp_geom = WORKER_SSP_GEOM
+    hits, misses = ssp_geom.cache_hits, ssp_geom.cache_misses
+    lines = list(match_ssps(ssp_geom, ssps, properties_keys))
+    return (
+        lines, ssp_geom.cache_hits - hits, ssp_geom.cache_misses - misses)
+
+
+def iter_route_chunks(ssps, chunk_size):
+    """Group consecutive ScheduleStopPairs of the same route into chunks
+
+    Keeping a route's records together lets a worker reuse its segment cache.
+    """
+    chunk = []
+    route_id = None
+    for ssp in ssps:
+        if chunk and (ssp['route_onestop_id'] != route_id
+                      or len(chunk) >= chunk_size):
+            yield chunk
+            chunk = []
+
+        route_id = ssp['route_onestop_id']
+        chunk.append(ssp)
+
+    if chunk:
+        yield chunk
+
+
+class RouteFileWriter:
+    """Write lines to one file per route
+
+    Input is expected to be grouped by route, so only one file is kept open at
+    a time. If a route reappears later in the stream, its file is appended to.
+    """
+    def __init__(self, output_dir):
+        super(RouteFileWriter, self).__init__()
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.route_id = None
+        self.f = None
+        self.seen = set()
+
+    def write(self, route_id, line):
+        if route_id != self.route_id:
+            self.open(route_id)
+
+        self.f.write(line)
+        self.f.write('\n')
+
+    def open(self, route_id):
+        if self.f:
+            self.f.close()
+
+        mode = 'a' if route_id in self.seen else 'w'
+        self.f = open(self.output_dir / f'{route_id}.geojson', mode)
+        self.route_id = route_id
+        self.seen.add(route_id)
+
+    def close(self):
+        """Close open file and mark all written routes as finished"""
+        if self.f:
+            self.f.close()
+            self.f = None
+
+        for route_id in self.seen:
+            (self.output_dir / f'{route_id}.finished').touch()
 
 
 class ScheduleStopPairGeometry:
@@ -71,12 +392,24 @@ class ScheduleStopPairGeometry:
     def __init__(self, stops_path, routes_path, rsp_path):
         super(ScheduleStopPairGeometry, self).__init__()
 
-        self.stops = load_list_as_dict(path=stops_path, id_key='id')
+        self.stops = StopTable(path=stops_path)
         self.routes = load_list_as_dict(path=routes_path, id_key='id')
         self.rsp = None
         if rsp_path:
             self.rsp = load_list_as_dict(path=rsp_path, id_key='id')
 
+        self.segment_cache = LRUCache(maxsize=SEGMENT_CACHE_SIZE)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def print_cache_stats(self):
+        """Print segment cache hit/miss counts to stderr"""
+        n = self.cache_hits + self.cache_misses
+        rate = self.cache_hits / n if n else 0
+        print(
+            f'Segment cache: {self.cache_hits} hits, {self.cache_misses} misses ({rate:.1%} hit rate)',
+            file=sys.stderr)
+
     def match_ssp_to_route(self, ssp, properties_keys):
         """Add geometry to ScheduleStopPair
 
@@ -101,6 +434,68 @@ class ScheduleStopPairGeometry:
                 file=sys.stderr)
             return None
 
+        # Stop-to-stop geometry is identical for every trip along the same
+        # segment; only the times differ. So look up the cut line and its
+        # vertex proportions in the segment cache before doing geometry work.
+        key = self.segment_key(ssp)
+        segment = self.segment_cache.get(key)
+        if segment is None:
+            self.cache_misses += 1
+            segment = self.match_segment(ssp, orig_stop, dest_stop)
+            self.segment_cache.set(key, segment)
+        else:
+            self.cache_hits += 1
+
+        coords, proportions = segment
+        if coords is None:
+            return None
+
+        # 6. For each coordinate of the `LineString` between `origin` and
+        # `destination`, linearly interpolate the timestamp between the
+        # origin timestamp and destination timestamp. Shouldn't have to
+        # simplify more because the geometry should already be simplified
+        # from transitland.
+        #
+        # Get start and end times as integers
+        start_time = time_str_to_seconds(ssp['origin_departure_time'])
+        end_time = time_str_to_seconds(ssp['destination_arrival_time'])
+
+        time_diff = end_time - start_time
+        times = np.round(start_time + (proportions * time_diff), 1)
+
+        # Create a new geometry where the third coordinate is the
+        # interpolated timestamp.
+        l = LineString(np.column_stack([coords, times]))
+
+        properties = {k: v for k, v in ssp.items() if k in properties_keys}
+        return geojson.Feature(geometry=l, properties=properties)
+
+    def segment_key(self, ssp):
+        """Key of ScheduleStopPair in segment cache
+
+        ScheduleStopPairs with a RouteStopPattern are keyed by the pattern and
+        linear distances. Otherwise the match depends on the route and stops,
+        and on the linear distances tried against the route's patterns.
+        """
+        rsp_id = ssp.get('route_stop_pattern_onestop_id')
+        orig_dist = ssp.get('origin_dist_traveled')
+        dest_dist = ssp.get('destination_dist_traveled')
+        if rsp_id in self.rsp:
+            return (rsp_id, orig_dist, dest_dist)
+
+        return (
+            ssp.get('route_onestop_id'), ssp['origin_onestop_id'],
+            ssp['destination_onestop_id'], orig_dist, dest_dist)
+
+    def match_segment(self, ssp, orig_stop, dest_stop):
+        """Find stop-to-stop geometry of ScheduleStopPair
+
+        Returns:
+            (coords, proportions), where coords is a NumPy array of shape
+            (n, 2) with the cut line, and proportions is a NumPy array with
+            the normalized distance along the cut line of each coordinate.
+            Both are None if no LineString could be matched.
+        """
         rsp_id = ssp.get('route_stop_pattern_onestop_id')
         route_id = ssp.get('route_onestop_id')
         rsp = self.rsp.get(rsp_id)
@@ -127,51 +522,56 @@ class ScheduleStopPairGeometry:
                     route=route, orig_stop=orig_stop, dest_stop=dest_stop)
         else:
             print(f'No route found for ssp: {ssp}', file=sys.stderr)
-            return None
+            return None, None
+
+        if cut_line is None:
+            return None, None
 
         # If cut_line is not a LineString, the linear referencing methods won't
         # work
         if cut_line.type != 'LineString':
             print(f'cut line has type {cut_line.type}', file=sys.stderr)
-            return None
-
-        # 6. For each coordinate of the `LineString` between `origin` and
-        # `destination`, linearly interpolate the timestamp between the
-        # origin timestamp and destination timestamp. Shouldn't have to
-        # simplify more because the geometry should already be simplified
-        # from transitland.
-        #
-        # Get start and end times as integers
-        start_time = time_str_to_seconds(ssp['origin_departure_time'])
-        end_time = time_str_to_seconds(ssp['destination_arrival_time'])
+            return None, None
 
         # Interpolate proportionally to distance for every point
         # _Technically_ it would be best to reproject into a projected
         # coordinate system for these distance calculations, but since the
         # distances are generally quite small, and since I only care about
         # distance _proportions_, I'll keep measurements in degrees for now.
-        proportions = []
-        for coord in cut_line.coords:
-            proportion = cut_line.project(Point(coord), normalized=True)
-            proportions.append(proportion)
+        coords = np.asarray(cut_line.coords)[:, :2]
+        return coords, vertex_proportions(coords)
 
-        time_diff = end_time - start_time
-        times = [round(start_time + (p * time_diff), 1) for p in proportions]
 
-        # Create a new geometry where the third coordinate is the
-        # interpolated timestamp.
-        l = LineString(
-            [(c[0], c[1], t) for c, t in zip(cut_line.coords, times)])
+def vertex_proportions(coords):
+    """Normalized distance along a line of each of its vertices
 
-        properties = {k: v for k, v in ssp.items() if k in properties_keys}
-        return geojson.Feature(geometry=l, properties=properties)
+    Computed in one pass from cumulative segment lengths, so that vertices of
+    lines that loop back on themselves still get increasing proportions.
+
+    Args:
+        - coords: NumPy array of shape (n, 2)
+
+    Returns:
+        NumPy array of shape (n,) with values from 0 to 1. All zeros if the
+        line has zero length.
+    """
+    diff = np.diff(coords, axis=0)
+    segment_lengths = np.sqrt(diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1])
+    distances = np.concatenate([[0], np.cumsum(segment_lengths)])
+    length = distances[-1]
+    if length == 0:
+        return np.zeros(len(coords))
+
+    return distances / length
 
 
 def match_using_route(route, orig_stop, dest_stop):
     """Assign geometry to ScheduleStopPair using route
+
+    orig_stop and dest_stop are (lon, lat) tuples from a StopTable.
     """
-    orig_stop_geom = asShape(orig_stop['geometry'])
-    dest_stop_geom = asShape(dest_stop['geometry'])
+    orig_stop_geom = Point(orig_stop)
+    dest_stop_geom = Point(dest_stop)
     route_geom = asShape(route['geometry'])
 
     # Note that orig_route_point and dest_route_point are not
@@ -210,19 +610,18 @@ def match_using_route(route, orig_stop, dest_stop):
 
 def match_using_rsp(ssp, rsp, orig_stop):
     """Assign geometry to ScheduleStopPair using RouteStopPattern
-    """
-    orig_stop_geom = shape(orig_stop['geometry'])
-    route_geom = shape(rsp['geometry'])
 
-    utm_epsg = get_local_utm_zone(orig_stop_geom)
+    orig_stop is a (lon, lat) tuple from a StopTable.
+    """
+    utm_epsg = get_local_utm_zone(Point(orig_stop))
 
     # Reproject route to meters using local UTM zone
-    proj_route_geom = reproject(route_geom, from_epsg=4326, to_epsg=utm_epsg)
+    proj_route_index = project_rsp(rsp, utm_epsg)
 
     # Take substring of route
     orig_m = float(ssp['origin_dist_traveled'])
     dest_m = float(ssp['destination_dist_traveled'])
-    proj_cut_route = substring(proj_route_geom, orig_m, dest_m)
+    proj_cut_route = proj_route_index.substring(orig_m, dest_m)
 
     # Reproject back to WGS84
     cut_route = reproject(proj_cut_route, from_epsg=utm_epsg, to_epsg=4326)
@@ -233,18 +632,15 @@ def attempt_match_among_rsps(ssp, rsps, orig_stop, dest_stop):
     """Attempt a match among rsps
 
     For each route stop pattern, cut it by ori
-    """
-    orig_stop_geom = asShape(orig_stop['geometry'])
-    dest_stop_geom = asShape(dest_stop['geometry'])
 
+    orig_stop and dest_stop are (lon, lat) tuples from a StopTable.
+    """
     cut_lines = []
     dists = []
     for rsp in rsps:
         cut_line = match_using_rsp(ssp, rsp, orig_stop)
-        start_dist = haversine(
-            orig_stop_geom.coords[0], cut_line.coords[0], Unit.METERS)
-        end_dist = haversine(
-            dest_stop_geom.coords[0], cut_line.coords[-1], Unit.METERS)
+        start_dist = haversine(orig_stop, cut_line.coords[0], Unit.METERS)
+        end_dist = haversine(dest_stop, cut_line.coords[-1], Unit.METERS)
 
         # Only allow matching if start and end are within 100 meters of stop
         if start_dist < 100 and end_dist < 100:
@@ -269,54 +665,165 @@ def substring(geom, start_dist, end_dist, normalized=False):
     If the start distances equals the end distance, a point is being returned.
     If the normalized arg is True, the distance will be interpreted as a
     fraction of the geometry's length.
-    """
 
+    For repeated queries on the same line, build a `LineIndex` once and call
+    its `substring` method instead.
+    """
     assert (isinstance(geom, LineString))
+    return LineIndex(geom).substring(start_dist, end_dist, normalized)
 
-    # Filter out cases in which to return a point
-    if start_dist == end_dist:
-        return geom.interpolate(start_dist, normalized)
-    elif not normalized and start_dist >= geom.length and end_dist >= geom.length:
-        return geom.interpolate(geom.length, normalized)
-    elif not normalized and -start_dist >= geom.length and -end_dist >= geom.length:
-        return geom.interpolate(0, normalized)
-    elif normalized and start_dist >= 1 and end_dist >= 1:
-        return geom.interpolate(1, normalized)
-    elif normalized and -start_dist >= 1 and -end_dist >= 1:
-        return geom.interpolate(0, normalized)
-
-    start_point = geom.interpolate(start_dist, normalized)
-    end_point = geom.interpolate(end_dist, normalized)
-
-    min_dist = min(start_dist, end_dist)
-    max_dist = max(start_dist, end_dist)
-    if normalized:
-        min_dist *= geom.length
-        max_dist *= geom.length
-
-    if start_dist < end_dist:
-        vertex_list = [(start_point.x, start_point.y)]
-    else:
-        vertex_list = [(end_point.x, end_point.y)]
 
-    coords = list(geom.coords)
-    current_distance = 0
-    for p1, p2 in zip(coords, coords[1:]):
-        if min_dist < current_distance < max_dist:
-            vertex_list.append(p1)
-        elif current_distance >= max_dist:
-            break
+class LineIndex:
+    """Linear-reference index for a LineString
 
-        current_distance += LineString([p1, p2]).length
+    Precomputes cumulative segment distances once, so that `interpolate` and
+    `substring` queries are answered by binary search over a NumPy array
+    instead of walking every vertex and allocating a shapely geometry per
+    segment.
+
+    Distances are computed the same way GEOS computes them, so results are
+    identical to `geom.interpolate` and the shapely-based substring.
+    """
+    def __init__(self, geom):
+        super(LineIndex, self).__init__()
+        assert (isinstance(geom, LineString))
+
+        self.coords = np.asarray(geom.coords)[:, :2]
+        diff = np.diff(self.coords, axis=0)
+        self.segment_lengths = np.sqrt(
+            diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1])
+        self.distances = np.concatenate([[0], np.cumsum(self.segment_lengths)])
+        self.length = float(self.distances[-1])
+
+    def interpolate_coords(self, dist, normalized=False):
+        """Return (x, y) coordinate at given distance along the line
+
+        Same semantics as shapely's `interpolate`
+        """
+        if normalized:
+            dist *= self.length
+        if dist < 0:
+            dist += self.length
+        if dist <= 0:
+            return tuple(self.coords[0])
+        if dist >= self.length:
+            return tuple(self.coords[-1])
+
+        # Index of segment such that distances[i] <= dist < distances[i + 1]
+        i = int(np.searchsorted(self.distances, dist, side='right')) - 1
+        frac = (dist - self.distances[i]) / self.segment_lengths[i]
+        p0 = self.coords[i]
+        p1 = self.coords[i + 1]
+        if frac >= 1:
+            return tuple(p1)
+        return (
+            p0[0] + frac * (p1[0] - p0[0]), p0[1] + frac * (p1[1] - p0[1]))
+
+    def interpolate(self, dist, normalized=False):
+        return Point(self.interpolate_coords(dist, normalized))
+
+    def substring_coords(self, start_dist, end_dist, normalized=False):
+        """Return coordinates of line segment between distances
+
+        Returns:
+            NumPy array of shape (n, 2). If n == 1, the substring is a point.
+        """
+        length = self.length
+
+        # Filter out cases in which to return a point
+        if start_dist == end_dist:
+            return np.array([self.interpolate_coords(start_dist, normalized)])
+        elif not normalized and start_dist >= length and end_dist >= length:
+            return np.array([self.interpolate_coords(length, normalized)])
+        elif not normalized and -start_dist >= length and -end_dist >= length:
+            return np.array([self.interpolate_coords(0, normalized)])
+        elif normalized and start_dist >= 1 and end_dist >= 1:
+            return np.array([self.interpolate_coords(1, normalized)])
+        elif normalized and -start_dist >= 1 and -end_dist >= 1:
+            return np.array([self.interpolate_coords(0, normalized)])
+
+        start_point = self.interpolate_coords(start_dist, normalized)
+        end_point = self.interpolate_coords(end_dist, normalized)
+
+        min_dist = min(start_dist, end_dist)
+        max_dist = max(start_dist, end_dist)
+        if normalized:
+            min_dist *= length
+            max_dist *= length
+
+        # Keep interior vertices strictly between min_dist and max_dist. The
+        # last vertex is never kept, since the end point is clamped onto it.
+        vertex_distances = self.distances[:-1]
+        lo = np.searchsorted(vertex_distances, min_dist, side='right')
+        hi = np.searchsorted(vertex_distances, max_dist, side='left')
+        interior = self.coords[lo:max(lo, hi)]
+
+        if start_dist < end_dist:
+            return np.concatenate([[start_point], interior, [end_point]])
 
-    if start_dist < end_dist:
-        vertex_list.append((end_point.x, end_point.y))
-    else:
-        vertex_list.append((start_point.x, start_point.y))
         # reverse direction result
-        vertex_list = reversed(vertex_list)
+        return np.concatenate([[start_point], interior[::-1], [end_point]])
+
+    def substring(self, start_dist, end_dist, normalized=False):
+        """Return shapely geometry between distances along the line
+
+        Same semantics as `substring`: a Point is returned if the start and
+        end resolve to the same location, otherwise a LineString.
+        """
+        coords = self.substring_coords(start_dist, end_dist, normalized)
+        if len(coords) == 1:
+            return Point(coords[0])
+        return LineString(coords)
+
+
+class LRUCache:
+    """Minimal least-recently-used cache with a bounded number of entries
+    """
+    def __init__(self, maxsize):
+        super(LRUCache, self).__init__()
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def get(self, key):
+        value = self.data.get(key)
+        if value is not None:
+            self.data.move_to_end(key)
+        return value
 
-    return LineString(vertex_list)
+    def set(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+
+# Linear-reference indexes of projected RouteStopPattern geometries, keyed by
+# (rsp id, utm epsg). Many
+# ScheduleStopPairs share a handful of RouteStopPatterns, so this saves
+# reprojecting the full pattern for every pair, while the bound keeps memory
+# flat across large operators.
+PROJECTED_RSP_CACHE = LRUCache(maxsize=1024)
+
+# Max number of stop-to-stop segments kept by ScheduleStopPairGeometry
+SEGMENT_CACHE_SIZE = 100000
+
+
+def project_rsp(rsp, utm_epsg):
+    """Get LineIndex of RouteStopPattern reprojected to the given UTM zone
+
+    Args:
+        - rsp: dict representing a single RouteStopPattern feature
+        - utm_epsg: epsg integer of local UTM zone
+    """
+    key = (rsp['id'], utm_epsg)
+    proj_route_index = PROJECTED_RSP_CACHE.get(key)
+    if proj_route_index is None:
+        proj_route_geom = reproject(
+            shape(rsp['geometry']), from_epsg=4326, to_epsg=utm_epsg)
+        proj_route_index = LineIndex(proj_route_geom)
+        PROJECTED_RSP_CACHE.set(key, proj_route_index)
+
+    return proj_route_index
 
 
 def reproject(geometry, from_epsg, to_epsg):
@@ -327,12 +834,21 @@ def reproject(geometry, from_epsg, to_epsg):
         - to_epsg: new crs, should be epsg integer
         - from_epsg: old crs
     """
-    project = pyproj.Transformer.from_proj(
+    project = get_transformer(from_epsg, to_epsg)
+    return transform(project.transform, geometry)
+
+
+@lru_cache(maxsize=None)
+def get_transformer(from_epsg, to_epsg):
+    """Get pyproj Transformer between two coordinate systems
+
+    Constructing a Transformer is expensive, and there are only a handful of
+    UTM zones per operator, so transformers are cached for the process.
+    """
+    return pyproj.Transformer.from_proj(
         pyproj.Proj(init=f'epsg:{from_epsg}'),
         pyproj.Proj(init=f'epsg:{to_epsg}'))
 
-    return transform(project.transform, geometry)
-
 
 def get_local_utm_zone(point):
     # Find local UTM zone
@@ -361,6 +877,51 @@ def time_str_to_seconds(s):
     return (hours * 60 * 60) + (minutes * 60) + seconds
 
 
+class StopTable:
+    """Compact table of stop coordinates
+
+    Only the id and coordinates of each stop are kept: ids map to a row index,
+    and coordinates are stored in NumPy float64 arrays, instead of keeping
+    every stop as a parsed GeoJSON dict.
+    """
+    def __init__(self, path):
+        super(StopTable, self).__init__()
+
+        self.index = {}
+        lons = []
+        lats = []
+        for line in iter_file(path):
+            item = json.loads(line)
+            lon, lat = item['geometry']['coordinates'][:2]
+
+            # Later records overwrite earlier ones, as in load_list_as_dict
+            i = self.index.get(item['id'])
+            if i is None:
+                self.index[item['id']] = len(lons)
+                lons.append(lon)
+                lats.append(lat)
+            else:
+                lons[i] = lon
+                lats[i] = lat
+
+        self.lon = np.array(lons, dtype=np.float64)
+        self.lat = np.array(lats, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, stop_id):
+        return stop_id in self.index
+
+    def get(self, stop_id):
+        """Get (lon, lat) of stop, or None if stop does not exist"""
+        i = self.index.get(stop_id)
+        if i is None:
+            return None
+
+        return (float(self.lon[i]), float(self.lat[i]))
+
+
 def load_list_as_dict(path, id_key):
     """Load list of dicts into dict of dicts
 
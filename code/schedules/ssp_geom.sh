@@ -29,40 +29,32 @@ function ssp_geom() {
     # Make sure output directory exists
     mkdir -p data/ssp/geom
 
-    python code/schedules/select_ssp.py \
-        -f data/ssp/sqlite/ssp.db \
+    python code/schedules/ssp_geom.py \
+        --stops-path data/stops/$operator_id.geojson \
+        --routes-path data/routes/$operator_id.geojson \
+        --rsp-path data/rsp/route_stop_patterns.geojson \
+        `# Read ScheduleStopPairs directly from sqlite` \
+        --sqlite-path data/ssp/sqlite/ssp.db \
         --route-id "$route_id" \
         --service-date '2020-02-07' \
         --service-days-of-week 4 \
         --origin-departure-hour 16 \
         --origin-departure-hour 20 \
-        `# extra columns to extract from sqlite` \
-        -c destination_timepoint_source \
-        -c operator_onestop_id \
-        -c origin_timepoint_source \
-        -c trip \
-        `# Run python script to attach geometries to ScheduleStopPairs` \
-        `# - signifies that the ScheduleStopPair data is coming from stdin` \
-        | python code/schedules/ssp_geom.py \
-            --stops-path data/stops/$operator_id.geojson \
-            --routes-path data/routes/$operator_id.geojson \
-            --rsp-path data/rsp/route_stop_patterns.geojson \
-            `# property names to include in geojson output` \
-            `# I include extra properties for debugging; they'll be removed on final minification` \
-            -p destination_arrival_time \
-            -p destination_dist_traveled \
-            -p destination_onestop_id \
-            -p destination_timepoint_source \
-            -p operator_onestop_id \
-            -p origin_departure_time \
-            -p origin_dist_traveled \
-            -p origin_onestop_id \
-            -p origin_timepoint_source \
-            -p route_onestop_id \
-            -p route_stop_pattern_onestop_id \
-            -p trip \
-            - \
-            > data/ssp/geom/$route_id.geojson
+        `# property names to include in geojson output` \
+        `# I include extra properties for debugging; they'll be removed on final minification` \
+        -p destination_arrival_time \
+        -p destination_dist_traveled \
+        -p destination_onestop_id \
+        -p destination_timepoint_source \
+        -p operator_onestop_id \
+        -p origin_departure_time \
+        -p origin_dist_traveled \
+        -p origin_onestop_id \
+        -p origin_timepoint_source \
+        -p route_onestop_id \
+        -p route_stop_pattern_onestop_id \
+        -p trip \
+        > data/ssp/geom/$route_id.geojson
 
     # Declare that this operator id finished running
     echo "Finished running for route: ${route_id}"
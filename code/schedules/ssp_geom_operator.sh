@@ -0,0 +1,73 @@
+#! /usr/bin/env bash
+
+# Arg 1: operator_id
+# Matches ScheduleStopPairs of all routes of an operator in a single Python
+# process, so that stops, routes and route stop patterns are only loaded once.
+function ssp_geom_operator() {
+    operator_id=$1
+    echo "Running ssp_geom_operator.sh for operator: $operator_id"
+
+    if [ ! -f data/stops/$operator_id.geojson ]; then
+        echo "stops file does not exist for operator: $operator_id. Skipping."
+        exit 0
+    fi
+
+    if [ ! -f data/routes/$operator_id.geojson ]; then
+        echo "routes file does not exist for operator: $operator_id. Skipping."
+        exit 0
+    fi
+
+    # Make sure output directory exists
+    mkdir -p data/ssp/geom
+
+    # Routes of this operator that haven't finished yet
+    route_args=()
+    while read route_id; do
+        if [ ! -f data/ssp/geom/$route_id.finished ]; then
+            route_args+=(--route-id "$route_id")
+        fi
+    done < data/routes_onestop_ids/$operator_id.txt
+
+    if [ ${#route_args[@]} -eq 0 ]; then
+        echo "Already finished"
+        exit 0
+    fi
+    echo "Matching ScheduleStopPairs to geometries for $((${#route_args[@]} / 2)) routes"
+
+    python code/schedules/ssp_geom.py \
+        --stops-path data/stops/$operator_id.geojson \
+        --routes-path data/routes/$operator_id.geojson \
+        --rsp-path data/rsp/route_stop_patterns.geojson \
+        `# Read ScheduleStopPairs directly from sqlite` \
+        --sqlite-path data/ssp/sqlite/ssp.db \
+        "${route_args[@]}" \
+        --service-date '2020-02-07' \
+        --service-days-of-week 4 \
+        --origin-departure-hour 16 \
+        --origin-departure-hour 20 \
+        `# Write one file per route into data/ssp/geom` \
+        --output-dir data/ssp/geom \
+        `# property names to include in geojson output` \
+        -p destination_arrival_time \
+        -p destination_dist_traveled \
+        -p destination_onestop_id \
+        -p destination_timepoint_source \
+        -p operator_onestop_id \
+        -p origin_departure_time \
+        -p origin_dist_traveled \
+        -p origin_onestop_id \
+        -p origin_timepoint_source \
+        -p route_onestop_id \
+        -p route_stop_pattern_onestop_id \
+        -p trip \
+        || exit 1
+
+    # Routes without any selected ScheduleStopPairs are also finished
+    for ((i = 1; i < ${#route_args[@]}; i += 2)); do
+        touch data/ssp/geom/${route_args[$i]}.finished
+    done
+    echo "Finished running for operator: ${operator_id}"
+}
+
+# Run as main
+ssp_geom_operator "$1"
@@ -0,0 +1,176 @@
+"""
+import_ssp.py: Import ScheduleStopPairs from gzipped JSON into SQLite
+
+Replaces converting to CSV with `ssp_keys.jq`/`ssp_values.jq` and importing
+with `sqlite3 .import`, which leaves every column as TEXT. Records are streamed
+from `ssp*.json.gz` into the typed schema in `ssp_create_table.sql`, including
+the derived columns used by `code/schedules/select_ssp.py`. Indexes are built
+after the load.
+
+```
+python code/ssp/import_ssp.py -f data/ssp/sqlite/ssp.db data/ssp/ssp*.json.gz
+```
+"""
+import gzip
+import json
+import sqlite3
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import click
+
+# Derived columns are computed with the same helpers select_ssp.py queries with
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'schedules'))
+import select_ssp  # noqa: E402
+
+CREATE_TABLE_PATH = Path(__file__).parent / 'ssp_create_table.sql'
+
+INDEX_SQL = '''
+CREATE INDEX IF NOT EXISTS route_onestop_id_departure_idx
+    ON ssp(route_onestop_id, origin_departure_seconds);
+ANALYZE;
+'''
+
+
+@click.command()
+@click.option(
+    '-f',
+    '--sqlite-path',
+    type=click.Path(dir_okay=False, file_okay=True, writable=True),
+    required=True,
+    help='Path to sqlite database to create or append to')
+@click.option(
+    '--batch-size',
+    type=int,
+    default=100000,
+    show_default=True,
+    help='Number of rows inserted per executemany call')
+@click.option(
+    '--no-index',
+    is_flag=True,
+    default=False,
+    help='Skip building indexes after the load')
+@click.argument(
+    'ssp-paths',
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, dir_okay=False, file_okay=True, readable=True))
+def main(sqlite_path, batch_size, no_index, ssp_paths):
+    """Import gzipped newline-delimited ScheduleStopPairs into SQLite
+    """
+    conn = sqlite3.connect(sqlite_path)
+
+    # The database can be rebuilt from the source files, so durability isn't
+    # needed during the load
+    conn.execute('PRAGMA journal_mode = OFF;')
+    conn.execute('PRAGMA synchronous = OFF;')
+
+    with open(CREATE_TABLE_PATH) as f:
+        create_table_sql = f.read()
+    create_table_sql = create_table_sql.replace(
+        'CREATE TABLE ssp', 'CREATE TABLE IF NOT EXISTS ssp')
+    conn.executescript(create_table_sql)
+
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(ssp);')]
+    placeholders = ', '.join('?' for _ in columns)
+    insert_sql = f'INSERT INTO ssp ({", ".join(columns)}) VALUES ({placeholders});'
+
+    start = time.time()
+    n_rows = 0
+    for path in ssp_paths:
+        print(f'Importing {path}', file=sys.stderr)
+        records = iter_gzip_json(path)
+        rows = (record_to_row(record, columns) for record in records)
+        for batch in iter_batches(rows, batch_size):
+            # One transaction per batch
+            with conn:
+                conn.executemany(insert_sql, batch)
+
+            n_rows += len(batch)
+            elapsed = time.time() - start
+            print(
+                f'{n_rows} rows, {n_rows / elapsed:.0f} rows/sec',
+                file=sys.stderr)
+
+    if not no_index:
+        print('Building indexes', file=sys.stderr)
+        conn.executescript(INDEX_SQL)
+
+    conn.close()
+    elapsed = time.time() - start
+    print(
+        f'Imported {n_rows} rows in {elapsed:.1f}s ({n_rows / max(elapsed, 1e-9):.0f} rows/sec)',
+        file=sys.stderr)
+
+
+def record_to_row(record, columns):
+    """Convert ScheduleStopPair record to tuple of column values
+
+    Array fields are dropped, except for `service_days_of_week`, which is
+    split into one column per day and packed into a bitmask. Derived columns
+    are computed the same way as in `ssp_derived_columns.sql`.
+
+    Args:
+        - record: dict representing a single ScheduleStopPair
+        - columns: list of column names in the ssp table
+    """
+    record = dict(record)
+    days = record.pop('service_days_of_week', None) or [False] * 7
+    record.pop('service_added_dates', None)
+    record.pop('service_except_dates', None)
+
+    for i, day in enumerate(days):
+        record[f'service_days_of_week_{i}'] = int(bool(day))
+
+    record['service_days_of_week_mask'] = select_ssp.days_of_week_mask(
+        i for i, day in enumerate(days) if day)
+    record['origin_departure_seconds'] = time_str_to_seconds(
+        record.get('origin_departure_time'))
+    record['service_start_julian'] = select_ssp.julian_day(
+        record.get('service_start_date'))
+    record['service_end_julian'] = select_ssp.julian_day(
+        record.get('service_end_date'))
+
+    return tuple(record.get(column) for column in columns)
+
+
+@lru_cache(maxsize=None)
+def time_str_to_seconds(s):
+    """Convert '%H:%M:%S' time str to integer seconds past midnight
+
+    Hours may be >= 24 for trips past midnight. Returns None if s is None.
+    """
+    if s is None:
+        return None
+
+    hours, minutes, seconds = s.split(':')
+    return (int(hours) * 60 * 60) + (int(minutes) * 60) + int(seconds)
+
+
+def iter_gzip_json(path):
+    """Generator of records in gzipped newline-delimited JSON file
+    """
+    with gzip.open(path, 'rt') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_batches(iterable, batch_size):
+    """Generator of lists of up to batch_size items
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
--- Not currently used, currently all fields are text from the default csv import
+-- Typed schema used by code/ssp/import_ssp.py
+-- The last four columns are derived from other fields on import; see
+-- code/ssp/ssp_derived_columns.sql for how they are defined.
 CREATE TABLE ssp (
     origin_onestop_id TEXT,
     destination_onestop_id TEXT,
@@ -24,15 +26,15 @@ CREATE TABLE ssp (
     destination_departure_time TEXT,
     origin_dist_traveled REAL,
     destination_dist_traveled REAL,
-    service_start_date INT,
-    service_end_date INT,
+    service_start_date TEXT,
+    service_end_date TEXT,
     window_start TEXT,
     window_end TEXT,
     origin_timepoint_source TEXT,
     destination_timepoint_source TEXT,
     frequency_start_time TEXT,
     frequency_end_time TEXT,
-    frequency_headway_seconds TEXT,
+    frequency_headway_seconds INT,
     frequency_type TEXT,
     created_at TEXT,
     updated_at TEXT,
@@ -43,4 +45,8 @@ CREATE TABLE ssp (
     service_days_of_week_4 INT,
     service_days_of_week_5 INT,
     service_days_of_week_6 INT,
-)
+    origin_departure_seconds INT,
+    service_start_julian INT,
+    service_end_julian INT,
+    service_days_of_week_mask INT
+);
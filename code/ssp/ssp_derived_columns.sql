@@ -0,0 +1,31 @@
+-- Derived integer columns and indexes used by code/schedules/select_ssp.py
+--
+-- Filtering on text columns with SUBSTR() or DATE() can't use an index, so
+-- every query scanned all rows of a route. Run once after importing:
+--     sqlite3 data/ssp/sqlite/ssp.db < code/ssp/ssp_derived_columns.sql
+ALTER TABLE ssp ADD COLUMN origin_departure_seconds INT;
+ALTER TABLE ssp ADD COLUMN service_start_julian INT;
+ALTER TABLE ssp ADD COLUMN service_end_julian INT;
+ALTER TABLE ssp ADD COLUMN service_days_of_week_mask INT;
+
+-- Days of week are 'true'/'false' from the csv import, or 1/0 when typed
+UPDATE ssp SET
+    origin_departure_seconds =
+        CAST(SUBSTR(origin_departure_time, 1, 2) AS INT) * 3600
+        + CAST(SUBSTR(origin_departure_time, 4, 2) AS INT) * 60
+        + CAST(SUBSTR(origin_departure_time, 7, 2) AS INT),
+    service_start_julian = CAST(JULIANDAY(service_start_date) AS INT),
+    service_end_julian = CAST(JULIANDAY(service_end_date) AS INT),
+    service_days_of_week_mask =
+        (service_days_of_week_0 IN ('true', 1))
+        | ((service_days_of_week_1 IN ('true', 1)) << 1)
+        | ((service_days_of_week_2 IN ('true', 1)) << 2)
+        | ((service_days_of_week_3 IN ('true', 1)) << 3)
+        | ((service_days_of_week_4 IN ('true', 1)) << 4)
+        | ((service_days_of_week_5 IN ('true', 1)) << 5)
+        | ((service_days_of_week_6 IN ('true', 1)) << 6);
+
+CREATE INDEX IF NOT EXISTS route_onestop_id_departure_idx
+    ON ssp(route_onestop_id, origin_departure_seconds);
+DROP INDEX IF EXISTS route_onestop_id_idx;
+ANALYZE;
@@ -0,0 +1,121 @@
+"""
+bench_schedule_tile.py: Compare ScheduleTile (v2) and ScheduleTileV3 tiles
+
+Encodes the newline-delimited GeoJSON tiles of the given zooms in both
+formats, and reports total encoded and gzipped sizes, time to decode, and the
+maximum error of v3 coordinates. E.g.
+```
+python code/tile/bench_schedule_tile.py -d data/ssp/tiles -z 13 -z 10
+```
+"""
+import gzip
+import json
+import time
+from pathlib import Path
+
+import click
+import mercantile
+import numpy as np
+
+import schedule_tile_pbf
+
+
+@click.command()
+@click.option(
+    '-d',
+    '--tile-dir',
+    type=click.Path(exists=True, file_okay=False, dir_okay=True),
+    required=True,
+    help='Root of directory with GeoJSON tiles')
+@click.option(
+    '-z',
+    '--zoom',
+    type=int,
+    required=True,
+    multiple=True,
+    help='Zoom level to compare. Can be provided multiple times.')
+@click.option(
+    '-n',
+    '--max-tiles',
+    type=int,
+    default=None,
+    help='Max number of tiles per zoom to compare')
+def main(tile_dir, zoom, max_tiles):
+    """Compare sizes and decoding speed of v2 and v3 schedule tiles
+    """
+    tile_dir = Path(tile_dir)
+    for z in zoom:
+        paths = sorted((tile_dir / str(z)).glob('*/*.geojson'))[:max_tiles]
+        totals = compare_tiles(paths, z)
+
+        n_coords = max(totals['n_coords'], 1)
+        print(f'Zoom {z}: {len(paths)} tiles, {totals["n_coords"]} coords')
+        for version in schedule_tile_pbf.PBF_VERSIONS:
+            raw = totals[f'{version}_raw']
+            gz = totals[f'{version}_gzip']
+            decode = totals[f'{version}_decode']
+            print(
+                f'  {version}: {raw} bytes ({raw / n_coords:.2f}/coord), '
+                f'{gz} gzipped ({gz / n_coords:.2f}/coord), '
+                f'decoded in {decode * 1000:.1f} ms')
+        print(
+            f'  v3 / v2 gzipped size: '
+            f'{totals["v3_gzip"] / max(totals["v2_gzip"], 1):.2f}')
+        print(
+            f'  v3 max error: {totals["max_position_error"]:.2e} degrees, '
+            f'{totals["max_time_error"]:.3f} seconds')
+
+
+def compare_tiles(paths, zoom):
+    """Encode tiles in both versions and sum sizes and decoding times"""
+    totals = {
+        'n_coords': 0,
+        'max_position_error': 0,
+        'max_time_error': 0,
+    }
+    for version in schedule_tile_pbf.PBF_VERSIONS:
+        for key in ['raw', 'gzip', 'decode']:
+            totals[f'{version}_{key}'] = 0
+
+    decoders = {
+        'v2': schedule_tile_pbf.decode_schedule_tile,
+        'v3': schedule_tile_pbf.decode_schedule_tile_v3,
+    }
+    for path in paths:
+        tile = mercantile.Tile(int(path.parent.name), int(path.stem), zoom)
+        with open(path) as f:
+            coords_list = [
+                np.asarray(json.loads(line)['geometry']['coordinates'])
+                for line in f if line.strip()]
+        if not coords_list:
+            continue
+
+        coords = np.concatenate(coords_list)
+        totals['n_coords'] += len(coords)
+
+        for version in schedule_tile_pbf.PBF_VERSIONS:
+            encoded = schedule_tile_pbf.encode_tile(coords_list, tile, version)
+            compressed = schedule_tile_pbf.gzip_compress(encoded)
+            totals[f'{version}_raw'] += len(encoded)
+            totals[f'{version}_gzip'] += len(compressed)
+
+            # Clients receive gzipped tiles, so include decompression
+            start = time.perf_counter()
+            positions, timestamps, _ = decoders[version](
+                gzip.decompress(compressed))
+            totals[f'{version}_decode'] += time.perf_counter() - start
+
+            if version == 'v3':
+                position_error = np.abs(
+                    positions.reshape(-1, 2) - coords[:, :2]).max()
+                time_error = np.abs(timestamps - coords[:, 2]).max()
+                totals['max_position_error'] = max(
+                    totals['max_position_error'], position_error)
+                totals['max_time_error'] = max(
+                    totals['max_time_error'], time_error)
+
+    return totals
+
+
+if __name__ == '__main__':
+    main()
@@ -8,14 +8,87 @@ side, keeping a random fraction is simple, and should maintain a general sense
 of areas with more transit schedules. As a con, this most likely creates
 discontinuities at tile boundaries, since a transit route may be randomly
 removed from one side of the tile boundary, but kept in the other.
+
+To avoid these discontinuities, use `--thinning trip`. Each trip is then given
+a rank from a hash of its identity, and every tile keeps the lowest-ranked
+trips that fit. Since all tiles share the same ranking, a trip kept in a dense
+tile is also kept in every sparser tile it crosses, and in its lower-zoom
+tiles.
+
+`--thinning importance` instead keeps the most important trips, scored by the
+vehicle type of their route (from `--routes-path`, required) and the number of
+trips of their route in all tiles of `--existing-zoom`, so that trunk lines
+survive at low zooms. Scores don't depend on the tile, so like `trip`, a route
+is ranked the same in neighboring tiles.
+`--simplify-tolerance` additionally simplifies the path of every feature with
+Douglas-Peucker. Only the XY path is simplified; kept vertices keep their
+original timestamps.
+
+`--max-bytes` replaces `--max-coords` with a budget for the gzipped
+`ScheduleTile` PBF of each tile, as written by `code/pbf/geojson_to_pbf.py`.
+Features are selected by their encoded size, and the selection is encoded and
+compressed to check that it fits. With `--time-bucket-minutes`, features are
+selected from the whole tile and the budget applies to the sum of its buckets.
+
+Parent tiles of a zoom level are independent of each other, so they're
+generated in a pool of worker processes. Features are kept as the raw lines of
+the child tiles and written back unchanged. Only their properties are decoded,
+and their coordinates are counted without decoding them, so each worker holds
+little more than the text of the features of one parent tile at a time.
 """
 
+import bisect
+import hashlib
+import io
+import itertools
+import json
+import multiprocessing
 import random
+import re
+from collections import namedtuple
 from pathlib import Path
 
 import click
-import geojson
 import mercantile
+import numpy as np
+from shapely.geometry import LineString
+
+import schedule_tile_pbf
+import tile_store
+
+THINNING_METHODS = ('random', 'trip', 'importance')
+
+# A feature of a tile, kept as its raw GeoJSON line
+TileFeature = namedtuple(
+    'TileFeature', ['n_coords', 'route_id', 'trip_key', 'line'])
+
+# Importance of a trip by the Transitland vehicle_type of its route. Vehicle
+# types not listed have weight 1.
+VEHICLE_TYPE_WEIGHTS = {
+    'metro': 4,
+    'subway': 4,
+    'rail': 4,
+    'suburban_railway': 4,
+    'tram': 2,
+    'ferry': 2,
+    'bus': 1,
+}
+
+# Mapping from route onestop id to importance of its trips, set before forking
+# workers
+ROUTE_IMPORTANCE = {}
+
+# Tile size in pixels, used to convert --simplify-tolerance to degrees
+TILE_SIZE = 512
+
+# Start of the value of the properties of a GeoJSON line
+PROPERTIES_RE = re.compile(r'"properties"\s*:\s*')
+
+# Coordinates of a GeoJSON line, and the start of each position in them
+COORDINATES_RE = re.compile(r'"coordinates"\s*:\s*(\[[-+0-9.eE,\[\]\s]*\])')
+POSITION_RE = re.compile(r'\[\s*[-+0-9.]')
+
+JSON_DECODER = json.JSONDecoder()
 
 
 @click.command()
@@ -38,10 +111,11 @@ import mercantile
     '-d',
     '--tile-dir',
     type=click.Path(
-        file_okay=False, dir_okay=True, readable=True, writable=True),
+        exists=True, file_okay=True, dir_okay=True, readable=True,
+        writable=True),
     required=True,
     help=
-    'Root of directory with tiles. The folder `existing-zoom` will not be modified, but lower zooms (down to min-zoom) will be added.'
+    'Root of directory with tiles, or path of an `.mbtiles` file written by `tile_geojson.py`. The tiles of `existing-zoom` will not be modified, but lower zooms (down to min-zoom) will be added.'
 )
 @click.option(
     '--max-coords',
@@ -50,107 +124,606 @@ import mercantile
     help=
     'Max number of coordinates in a tile. I found that a gzip-compressed tile with ~800,000 coordinates was ~2MB, so in order to keep gzip-compressed tiles to around 500KB, 200,000 coordinates is probably a good ballpark estimate for maximum number of coordinates.'
 )
-def main(min_zoom, existing_zoom, tile_dir, max_coords):
+@click.option(
+    '--max-bytes',
+    type=int,
+    default=None,
+    help=
+    'Max size in bytes of the gzipped ScheduleTile PBF of a tile. If provided, used instead of --max-coords.'
+)
+@click.option(
+    '-j',
+    '--workers',
+    type=int,
+    default=multiprocessing.cpu_count(),
+    show_default=True,
+    help='Number of worker processes')
+@click.option(
+    '--seed',
+    type=int,
+    default=0,
+    show_default=True,
+    help=
+    'Seed for choosing which features to keep. Each tile is seeded with this and its own x, y, z, so the same seed always produces the same tiles.'
+)
+@click.option(
+    '--thinning',
+    type=click.Choice(THINNING_METHODS),
+    default='random',
+    show_default=True,
+    help=
+    'How to choose features to keep. `random` shuffles each tile independently; `trip` keeps the same trips in every tile, ranked by a hash of route and trip id; `importance` keeps the trips of the most important routes.'
+)
+@click.option(
+    '--routes-path',
+    type=click.Path(exists=True, dir_okay=False, file_okay=True, readable=True),
+    required=False,
+    default=None,
+    multiple=True,
+    help=
+    'Newline-delimited GeoJSON file with Transit.land routes, used for vehicle types with `--thinning importance`, where it is required. Can be provided multiple times.'
+)
+@click.option(
+    '--simplify-tolerance',
+    type=float,
+    default=None,
+    help=
+    'If provided, simplify features of overview tiles with Douglas-Peucker, with this tolerance in pixels of a 512px tile.'
+)
+@click.option(
+    '--pbf-dir',
+    type=click.Path(file_okay=True, dir_okay=True, writable=True),
+    required=False,
+    default=None,
+    help=
+    'If provided, also write each overview tile as a gzipped ScheduleTile PBF to `{pbf-dir}/{z}/{x}/{y}.pbf`, as `code/tile/compress_tiles_pbf.sh` would, or to an `.mbtiles` file.'
+)
+@click.option(
+    '--pbf-version',
+    type=click.Choice(schedule_tile_pbf.PBF_VERSIONS),
+    default='v2',
+    show_default=True,
+    help=
+    'Message used for --pbf-dir and --max-bytes: `v2` is ScheduleTile; `v3` is the quantized, delta-encoded ScheduleTileV3.'
+)
+@click.option(
+    '--time-bucket-minutes',
+    type=int,
+    required=False,
+    default=None,
+    help=
+    'If provided, split the PBF tiles into buckets of this many minutes, as `code/tile/tile_geojson.py --time-bucket-minutes` does.'
+)
+def main(
+        min_zoom, existing_zoom, tile_dir, max_coords, max_bytes, workers,
+        seed, thinning, routes_path, simplify_tolerance, pbf_dir,
+        pbf_version, time_bucket_minutes):
     """Create overview tiles
     """
+    if thinning == 'importance' and not routes_path:
+        raise click.UsageError(
+            '--routes-path is required with --thinning importance')
+
     tile_dir = Path(tile_dir)
-    while existing_zoom > min_zoom:
-        print(f'Generating overview tiles for zoom {existing_zoom - 1}')
-        generate_overview_for_zoom(existing_zoom, tile_dir, max_coords)
-        existing_zoom -= 1
+    tiles = find_tiles(tile_dir, existing_zoom)
+    options = {
+        'max_coords': max_coords,
+        'max_bytes': max_bytes,
+        'seed': seed,
+        'thinning': thinning,
+        'simplify_tolerance': simplify_tolerance,
+        'pbf_dir': Path(pbf_dir) if pbf_dir else None,
+        'pbf_version': pbf_version,
+        'time_bucket_seconds':
+        time_bucket_minutes * 60 if time_bucket_minutes else None,
+    }
 
+    ctx = multiprocessing.get_context('fork')
+    if thinning == 'importance':
+        # Workers inherit this when forked
+        with ctx.Pool(workers) as pool:
+            ROUTE_IMPORTANCE.update(
+                route_importance(
+                    load_route_vehicle_types(routes_path),
+                    count_route_trips(tiles, tile_dir, pool)))
 
-def generate_overview_for_zoom(existing_zoom, tile_dir, max_coords):
-    """Generate overview tiles for a given zoom level
+    # Restart workers periodically so memory freed after large parent tiles is
+    # returned to the OS
+    with ctx.Pool(workers, maxtasksperchild=1000) as pool:
+        while existing_zoom > min_zoom:
+            print(f'Generating overview tiles for zoom {existing_zoom - 1}')
+            tiles = generate_overview_for_zoom(tiles, tile_dir, pool, options)
+            existing_zoom -= 1
+
+    tile_store.close_tile_stores()
+
+
+def find_tiles(tile_dir, zoom):
+    """Set of existing tiles for a zoom level"""
+    store = tile_store.open_tile_store(tile_dir, '.geojson')
+    return set(store.iter_tiles(zoom))
+
+
+def load_route_vehicle_types(paths):
+    """Mapping from route onestop id to vehicle type
 
     Args:
-        - existing_zoom: the zoom level for which tiles already exist
+        - paths: paths to newline-delimited GeoJSON files of routes
+    """
+    vehicle_types = {}
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                properties = decode_properties(line)
+                vehicle_types[properties['onestop_id']] = properties.get(
+                    'vehicle_type')
+
+    return vehicle_types
+
+
+def count_route_trips(tiles, tile_dir, pool):
+    """Number of distinct trips of each route in tiles
+
+    Args:
+        - tiles: set of existing tiles
         - tile_dir: the root of directory with tiles
+        - pool: multiprocessing pool used to read tiles
+
+    Returns:
+        dict of route onestop id to number of trips
+    """
+    route_trips = {}
+    tasks = [(tile, tile_dir) for tile in tiles]
+    for tile_route_trips in pool.imap_unordered(
+            load_route_trips, tasks, chunksize=16):
+        for route_id, trip_keys in tile_route_trips.items():
+            route_trips.setdefault(route_id, set()).update(trip_keys)
+
+    return {
+        route_id: len(trip_keys)
+        for route_id, trip_keys in route_trips.items()}
+
+
+def load_route_trips(task):
+    """Dict of route onestop id to set of trip keys in a tile
+
+    Args:
+        - task: tuple of (tile, tile_dir)
     """
-    zoom_dir = tile_dir / str(existing_zoom)
-    tile_coords = []
-    for path in zoom_dir.glob('*/*.geojson'):
-        y = int(path.stem)
-        x = int(path.parents[0].name)
-        tile_coords.append((x, y))
+    tile, tile_dir = task
+    route_trips = {}
+    for feature in load_features(tile=tile, tile_dir=tile_dir):
+        route_trips.setdefault(feature.route_id, set()).add(feature.trip_key)
 
-    tiles = [mercantile.Tile(x, y, existing_zoom) for x, y in tile_coords]
+    return route_trips
+
+
+def route_importance(vehicle_types, route_trips):
+    """Importance of the trips of each route
+
+    The weight of the route's vehicle type times its number of trips.
+
+    Args:
+        - vehicle_types: dict of route onestop id to vehicle type
+        - route_trips: dict of route onestop id to number of trips
+    """
+    importance = {}
+    for route_id, n_trips in route_trips.items():
+        weight = VEHICLE_TYPE_WEIGHTS.get(vehicle_types.get(route_id), 1)
+        importance[route_id] = weight * n_trips
+
+    return importance
+
+
+def generate_overview_for_zoom(tiles, tile_dir, pool, options):
+    """Generate overview tiles for a given zoom level
+
+    Args:
+        - tiles: set of existing tiles of a single zoom level
+        - tile_dir: the root of directory with tiles
+        - pool: multiprocessing pool used to generate parent tiles
+        - options: dict of options for generate_parent_tile
+
+    Returns:
+        set of generated parent tiles
+    """
     parents = {mercantile.parent(t) for t in tiles}
+    tasks = []
     for parent in parents:
         # Which of its children exist?
         children = [c for c in mercantile.children(parent) if c in tiles]
+        tasks.append((parent, children, tile_dir, options))
+
+    for _ in pool.imap_unordered(generate_parent_tile, tasks, chunksize=16):
+        pass
+
+    return parents
+
+
+def generate_parent_tile(task):
+    """Generate a single parent tile from its existing children
+
+    Args:
+        - task: tuple of (parent tile, list of existing child tiles, tile_dir,
+          options). options is a dict with keys:
+            - max_coords: max number of coordinates in a tile
+            - max_bytes: max gzipped PBF bytes in a tile, or None. Replaces
+              max_coords if provided.
+            - seed: seed for choosing which features to keep
+            - thinning: one of THINNING_METHODS
+            - simplify_tolerance: Douglas-Peucker tolerance in tile pixels, or
+              None
+            - pbf_dir: root of directory to also write PBF tiles to, or None
+            - pbf_version: one of schedule_tile_pbf.PBF_VERSIONS
+            - time_bucket_seconds: length of time buckets PBF tiles are split
+              into, or None
+    """
+    parent, children, tile_dir, options = task
+    seed = options['seed']
+    thinning = options['thinning']
+    pbf_dir = options['pbf_dir']
+    pbf_version = options['pbf_version']
+    time_bucket_seconds = options['time_bucket_seconds']
+
+    # If the parent only has one child, then you can assume the child was
+    # already small enough, and just copy
+    if len(children) == 1 and not options['simplify_tolerance']:
+        store = tile_store.open_tile_store(tile_dir, '.geojson')
+        store.write_tile(parent, store.read_tile(children[0]))
+
+        # v3 tiles store coordinates relative to their tile, so can't be
+        # copied, and bucketed tiles are re-encoded rather than copying each
+        # bucket
+        if pbf_dir:
+            pbf_store = tile_store.open_tile_store(pbf_dir, '.pbf')
+            child_pbf = None
+            if pbf_version == 'v2' and not time_bucket_seconds:
+                child_pbf = pbf_store.read_tile(children[0])
+
+            if child_pbf is not None:
+                pbf_store.write_tile(parent, child_pbf)
+            else:
+                features = load_features(tile=children[0], tile_dir=tile_dir)
+                write_pbf(
+                    features, parent, pbf_dir, pbf_version,
+                    time_bucket_seconds)
+        return
+
+    # Otherwise, we have more than one child.
+    # Load all the features, then determine if there are too many
+    features = []
+    for child in children:
+        features.extend(load_features(tile=child, tile_dir=tile_dir))
+
+    if options['simplify_tolerance']:
+        # Convert from pixels to degrees at the parent's zoom
+        tolerance = (
+            options['simplify_tolerance'] * 360 / (2 ** parent.z * TILE_SIZE))
+        features = [simplify_feature(f, tolerance) for f in features]
+
+    def select(features, max_cost, cost):
+        if thinning == 'trip':
+            return thin_features_by_trip(features, max_cost, seed, cost)
+        if thinning == 'importance':
+            return select_important_features(features, max_cost, seed, cost)
+
+        # Seed per tile, so that output doesn't depend on which worker
+        # generates which tile, or in what order
+        rng = random.Random(f'{seed}/{parent.z}/{parent.x}/{parent.y}')
+        return simplify_features(features, max_cost, rng, cost)
+
+    # Coordinates decoded for --max-bytes, reused to write PBF tiles
+    coords = {}
+    if options['max_bytes']:
+        features = fit_byte_budget(
+            features, options['max_bytes'], select,
+            lambda coords_list: sum(map(len, gzip_pbf_buckets(
+                coords_list, parent, pbf_version,
+                time_bucket_seconds).values())), coords)
+    else:
+        features = select(features, options['max_coords'], coord_cost)
+    write_geojson(features=features, tile=parent, tile_dir=tile_dir)
+    if pbf_dir:
+        write_pbf(
+            features, parent, pbf_dir, pbf_version, time_bucket_seconds,
+            coords)
 
-        # If the parent only has one child, then you can assume the child was
-        # already small enough, and just write
-        if len(children) == 1:
-            # Load the child's features
-            features = load_features(tile=children[0], tile_dir=tile_dir)
-            # And write to the parent's tile
-            write_geojson(features=features, tile=parent, tile_dir=tile_dir)
-            continue
 
-        # Otherwise, we have more than one child.
-        # Load all the features, then determine if there are too many
-        features = []
-        for child in children:
-            features.extend(load_features(tile=child, tile_dir=tile_dir))
+def coord_cost(feature):
+    """Cost of feature for --max-coords"""
+    return feature.n_coords
 
-        features = simplify_features(features, max_coords)
-        write_geojson(features=features, tile=parent, tile_dir=tile_dir)
 
+def pbf_cost(feature):
+    """Cost of feature for --max-bytes: its encoded size before gzip"""
+    return schedule_tile_pbf.estimated_feature_bytes(feature.n_coords)
 
-def simplify_features(features, max_coords):
-    """Remove features randomly to stay within maximum coordinate limit
+
+def fit_byte_budget(
+        features, max_bytes, select, compressed_size, coords=None):
+    """Select features so that the gzipped ScheduleTile is within max_bytes
+
+    Features are selected by their encoded size in ScheduleTile before
+    compression, with a budget derived from the ratio of the compressed size
+    of all features to that estimate. If the compressed selection is still too
+    large, the budget is reduced in proportion and features are selected
+    again.
 
     Args:
-        - features: list of geojson features
-        - max_coords: max number of individual (3D) coordinates
+        - features: list of TileFeature from load_features
+        - max_bytes: max size of gzipped ScheduleTile
+        - select: function of (features, max_cost, cost) returning the
+          selected features
+        - compressed_size: function of list of coordinate arrays returning
+          the size of the gzipped tile, or the sum over its time buckets
+        - coords: optional dict, filled with the coordinate array of each
+          feature by its line
+
+    Returns:
+        selected features
     """
-    n_coords = sum([len(f['geometry']['coordinates']) for f in features])
-    if n_coords < max_coords:
+    if coords is None:
+        coords = {}
+    for f in features:
+        coords[f.line] = feature_coords(f)
+
+    def features_size(features):
+        return compressed_size([coords[f.line] for f in features])
+
+    size = features_size(features)
+    if size <= max_bytes:
+        return features
+
+    total_cost = sum(pbf_cost(f) for f in features)
+    budget = max_bytes * total_cost / size
+    while True:
+        selected = select(
+            features, budget - schedule_tile_pbf.MAX_OVERHEAD_BYTES, pbf_cost)
+        size = features_size(selected)
+        if size <= max_bytes or not selected:
+            return selected
+
+        # Aim slightly below the budget so this converges quickly
+        budget *= 0.98 * max_bytes / size
+
+
+def simplify_features(features, max_cost, rng=random, cost=coord_cost):
+    """Keep a random subset of features within maximum coordinate limit
+
+    Features are shuffled once, and the longest prefix of the shuffled order
+    with at most max_cost is kept. Kept features stay in their original order.
+
+    Args:
+        - features: list of TileFeature from load_features
+        - max_cost: max total cost, by default the number of individual (3D)
+          coordinates
+        - rng: random.Random instance used to shuffle
+        - cost: function returning the cost of a feature
+    """
+    total_cost = sum(cost(f) for f in features)
+    if total_cost <= max_cost:
         return features
 
     # Else, need to simplify
-    while n_coords > max_coords:
-        # Take away 1% of features each iteration
-        n_features = len(features)
-        n_to_remove = round(n_features * .01)
+    order = list(range(len(features)))
+    rng.shuffle(order)
 
-        # Find indices of random features to remove
-        idx_to_remove = random.sample(range(n_features), n_to_remove)
+    # Number of shuffled features whose cumulative cost fits
+    cumulative = list(itertools.accumulate(cost(features[i]) for i in order))
+    n_keep = bisect.bisect_right(cumulative, max_cost)
 
-        # Take away those features
-        # Note that you need to delete them in reverse order so that you don't
-        # throw off the subsequent indexes
-        # https://stackoverflow.com/a/11303234
-        for idx in sorted(idx_to_remove, reverse=True):
-            del features[idx]
+    return [features[i] for i in sorted(order[:n_keep])]
 
-        # Recompute number of coords
-        n_coords = sum([len(f['geometry']['coordinates']) for f in features])
 
-    return features
+def thin_features_by_trip(features, max_cost, seed=0, cost=coord_cost):
+    """Keep whole trips with the lowest rank within maximum coordinate limit
+
+    The rank of a trip depends only on its identity and the seed, never on the
+    tile, so neighboring tiles agree on which trips to keep: a tile keeps
+    every trip ranked below some cutoff, and tiles with fewer coordinates have
+    a higher cutoff. Kept features stay in their original order.
+
+    Args:
+        - features: list of TileFeature from load_features
+        - max_cost: max total cost, by default the number of individual (3D)
+          coordinates
+        - seed: seed mixed into the hash of trip identities
+        - cost: function returning the cost of a feature
+    """
+    trip_costs = {}
+    for f in features:
+        trip_costs[f.trip_key] = trip_costs.get(f.trip_key, 0) + cost(f)
+
+    if sum(trip_costs.values()) <= max_cost:
+        return features
+
+    # Ties between hashes are broken by the key itself, so the order is total
+    ranked = sorted(trip_costs, key=lambda key: (trip_rank(key, seed), key))
+    cumulative = list(itertools.accumulate(trip_costs[key] for key in ranked))
+    n_keep = bisect.bisect_right(cumulative, max_cost)
+    keep = set(ranked[:n_keep])
+
+    return [f for f in features if f.trip_key in keep]
+
+
+def select_important_features(
+        features, max_cost, seed=0, cost=coord_cost):
+    """Keep whole trips with the highest importance within coordinate limit
+
+    The importance of a trip is that of its route in ROUTE_IMPORTANCE, the
+    same in every tile. Trips of equal importance are ordered by trip_rank,
+    as in thin_features_by_trip. Kept features stay in their original order.
+
+    Args:
+        - features: list of TileFeature from load_features
+        - max_cost: max total cost, by default the number of individual (3D)
+          coordinates
+        - seed: seed mixed into the hash of trip identities
+        - cost: function returning the cost of a feature
+    """
+    trip_costs = {}
+    trip_routes = {}
+    for f in features:
+        trip_costs[f.trip_key] = trip_costs.get(f.trip_key, 0) + cost(f)
+        trip_routes[f.trip_key] = f.route_id
+
+    if sum(trip_costs.values()) <= max_cost:
+        return features
+
+    def importance(key):
+        return ROUTE_IMPORTANCE.get(trip_routes[key], 0)
+
+    ranked = sorted(
+        trip_costs,
+        key=lambda key: (-importance(key), trip_rank(key, seed), key))
+    cumulative = list(itertools.accumulate(trip_costs[key] for key in ranked))
+    n_keep = bisect.bisect_right(cumulative, max_cost)
+    keep = set(ranked[:n_keep])
+
+    return [f for f in features if f.trip_key in keep]
+
+
+def simplify_feature(feature, tolerance):
+    """Simplify path of LineString feature with Douglas-Peucker
+
+    Distances are measured on the XY path only, and the time (third)
+    coordinate of every kept vertex is unchanged.
+
+    Args:
+        - feature: TileFeature
+        - tolerance: tolerance in degrees
+
+    Returns:
+        TileFeature
+    """
+    geojson_feature = json.loads(feature.line)
+    geometry = geojson_feature['geometry']
+    if geometry['type'] != 'LineString' or len(geometry['coordinates']) <= 2:
+        return feature
+
+    line = LineString(geometry['coordinates'])
+    coords = line.simplify(tolerance, preserve_topology=False).coords
+    if len(coords) == feature.n_coords:
+        return feature
+
+    geometry['coordinates'] = [list(coord) for coord in coords]
+    return feature._replace(
+        n_coords=len(coords),
+        line=json.dumps(geojson_feature, separators=(',', ':')))
+
+
+def trip_rank(trip_key, seed):
+    """Stable pseudo-random rank of a trip
+
+    Unlike hash(), doesn't change between Python processes
+    """
+    digest = hashlib.blake2b(
+        f'{seed}/{trip_key}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def trip_key(properties, line):
+    """Identity of the trip a feature belongs to
+
+    Every ScheduleStopPair of a trip has the same key, so that a trip is kept
+    or removed as a whole. A feature without a trip id is its own trip, keyed
+    by a hash of its properties, which its pieces in other tiles share, or of
+    its line if it has no properties.
+    """
+    trip = properties.get('trip')
+    if trip is None:
+        identity = json.dumps(properties, sort_keys=True) if properties else line
+        digest = hashlib.blake2b(
+            identity.encode('utf-8'), digest_size=8).hexdigest()
+        return f'feature/{digest}'
+
+    return f'{properties.get("route_onestop_id")}/{trip}'
 
 
 def load_features(tile, tile_dir):
-    path = tile_path(tile, tile_dir)
-    with open(path) as f:
-        return [geojson.loads(line) for line in f.readlines()]
+    """Load features of tile as TileFeature tuples
+
+    The line is kept as is, so it can be written out without serializing it
+    again.
+    """
+    data = tile_store.open_tile_store(tile_dir, '.geojson').read_tile(tile)
+    features = []
+    for line in io.BytesIO(data):
+        line = line.decode().rstrip('\n')
+        if not line.strip():
+            continue
+        properties = decode_properties(line)
+        features.append(
+            TileFeature(
+                n_coords=count_coords(line),
+                route_id=properties.get('route_onestop_id'),
+                trip_key=trip_key(properties, line),
+                line=line))
+
+    return features
+
+
+def decode_properties(line):
+    """Properties of a GeoJSON feature line, without decoding its geometry"""
+    match = PROPERTIES_RE.search(line)
+    if match:
+        properties, _ = JSON_DECODER.raw_decode(line, match.end())
+    else:
+        properties = json.loads(line).get('properties')
+
+    return properties or {}
+
+
+def count_coords(line):
+    """Number of positions of a GeoJSON feature line, without decoding them"""
+    match = COORDINATES_RE.search(line)
+    if not match:
+        return len(json.loads(line)['geometry']['coordinates'])
+
+    return len(POSITION_RE.findall(match.group(1)))
 
 
 def write_geojson(features, tile, tile_dir):
-    path = tile_path(tile, tile_dir)
-    # Make directory if it doesn't exist
-    path.parents[0].mkdir(exist_ok=True, parents=True)
-    with open(path, 'w') as f:
-        for feature in features:
-            f.write(geojson.dumps(feature, separators=(',', ':')))
-            f.write('\n')
-
-
-def tile_path(tile, tile_dir, ext='.geojson'):
-    x, y, z = tile.x, tile.y, tile.z
-    return tile_dir / str(z) / str(x) / f'{y}{ext}'
+    data = ''.join(f'{feature.line}\n' for feature in features).encode()
+    tile_store.open_tile_store(tile_dir, '.geojson').write_tile(tile, data)
+
+
+def write_pbf(
+        features, tile, pbf_dir, version='v2', time_bucket_seconds=None,
+        coords=None):
+    """Write features as a gzipped ScheduleTile PBF, or one per time bucket
+
+    coords is an optional dict of coordinate arrays already decoded, by line.
+    """
+    coords = coords or {}
+    coords_list = [
+        coords[f.line] if f.line in coords else feature_coords(f)
+        for f in features]
+    buckets = gzip_pbf_buckets(coords_list, tile, version, time_bucket_seconds)
+    for bucket, data in buckets.items():
+        store = tile_store.open_tile_store(
+            schedule_tile_pbf.bucket_dir(pbf_dir, bucket), '.pbf')
+        store.write_tile(tile, data)
+
+
+def gzip_pbf_buckets(
+        coords_list, tile, version='v2', time_bucket_seconds=None):
+    """Dict of time bucket, or None, to gzipped ScheduleTile of its features"""
+    groups = schedule_tile_pbf.group_by_time_bucket(
+        coords_list, time_bucket_seconds)
+    return {
+        bucket: schedule_tile_pbf.gzip_compress(
+            schedule_tile_pbf.encode_tile(bucket_coords_list, tile, version))
+        for bucket, bucket_coords_list in groups.items()}
+
+
+def feature_coords(feature):
+    """Array of coordinates of a LineString TileFeature"""
+    geometry = json.loads(feature.line)['geometry']
+    assert geometry['type'] == 'LineString', 'geometry must be LineString'
+    return np.asarray(geometry['coordinates'], dtype=np.float64)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,78 @@
+"""
+export_tiles.py: Export tiles of an MBTiles file to a directory
+
+Writes every tile of an `.mbtiles` file written by `tile_geojson.py` or
+`create_overview_tiles.py` to `{out-dir}/{z}/{x}/{y}{ext}`, with the extension
+from the `format` in its metadata, for uploading with `aws s3 cp --recursive`.
+Tile contents are written as stored, so PBF tiles stay gzipped. E.g.
+```
+python code/tile/export_tiles.py data/ssp/pbf.mbtiles data/ssp/pbf -z 13
+```
+"""
+import sqlite3
+import sys
+
+import click
+
+import tile_store
+
+# Number of tiles written at once
+EXPORT_BATCH_SIZE = 1000
+
+
+@click.command()
+@click.argument(
+    'mbtiles-path',
+    type=click.Path(
+        exists=True, file_okay=True, dir_okay=False, readable=True))
+@click.argument(
+    'out-dir', type=click.Path(file_okay=False, dir_okay=True, writable=True))
+@click.option(
+    '-z',
+    '--zoom',
+    type=int,
+    multiple=True,
+    help=
+    'Zoom level to export. Can be provided multiple times; all zooms are exported by default.'
+)
+def main(mbtiles_path, out_dir, zoom):
+    """Export tiles of an MBTiles file to a directory
+    """
+    ext = '.' + read_format(mbtiles_path)
+    store = tile_store.open_tile_store(mbtiles_path, ext)
+    out_store = tile_store.open_tile_store(out_dir, ext)
+
+    n_tiles = 0
+    for z in zoom or [None]:
+        batch = []
+        for item in store.iter_tile_data(z):
+            batch.append(item)
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                out_store.write_tiles(batch)
+                n_tiles += len(batch)
+                batch = []
+
+        out_store.write_tiles(batch)
+        n_tiles += len(batch)
+
+    tile_store.close_tile_stores()
+    print(f'Exported {n_tiles} tiles', file=sys.stderr)
+
+
+def read_format(mbtiles_path):
+    """Tile format from the metadata of an MBTiles file"""
+    conn = sqlite3.connect(mbtiles_path)
+    try:
+        row = conn.execute(
+            "SELECT value FROM metadata WHERE name = 'format';").fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        raise click.ClickException(f'No format in metadata of {mbtiles_path}')
+
+    return row[0]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,463 @@
+"""
+schedule_tile_pbf.py: Encode and size ScheduleTile protobuf messages
+
+Hand-encodes the `ScheduleTile` and `ScheduleTileV3` messages from
+`code/pbf/schedule_tile.proto` with NumPy, so that tiling scripts can compute
+the exact encoded size of a tile and write it without the generated protobuf
+code. The output is byte-for-byte the same as `SerializeToString()`.
+
+```proto
+message ScheduleTile {
+  repeated float positions = 1 [packed=true];
+  repeated float timestamps = 2 [packed=true];
+  repeated uint32 startIndices = 3 [packed=true];
+  optional uint32 length = 4;
+}
+```
+
+`ScheduleTileV3` stores positions as integer units of the tile and timestamps
+in deciseconds, both delta-encoded as packed sint32, so that most vertices
+take 3-4 bytes instead of 12.
+"""
+import gzip
+import math
+
+import numpy as np
+
+import tile_store
+
+# Field keys, i.e. (field_number << 3) | wire_type
+POSITIONS_KEY = (1 << 3) | 2
+TIMESTAMPS_KEY = (2 << 3) | 2
+START_INDICES_KEY = (3 << 3) | 2
+LENGTH_KEY = (4 << 3) | 0
+
+# Bytes per coordinate: two float32 positions and one float32 timestamp
+COORD_BYTES = 12
+
+# Upper bound of bytes of the start index of a feature, for indices < 2**28
+MAX_INDEX_BYTES = 4
+
+# Upper bound of bytes of the keys and lengths of all fields
+MAX_OVERHEAD_BYTES = 4 * (1 + 5)
+
+# ScheduleTileV3 field keys
+V3_Z_KEY = (1 << 3) | 0
+V3_X_KEY = (2 << 3) | 0
+V3_Y_KEY = (3 << 3) | 0
+V3_EXTENT_KEY = (4 << 3) | 0
+V3_POSITIONS_KEY = (5 << 3) | 2
+V3_TIMESTAMPS_KEY = (6 << 3) | 2
+V3_START_INDICES_KEY = (7 << 3) | 2
+V3_LENGTH_KEY = (8 << 3) | 0
+
+# Number of integer units per tile side in ScheduleTileV3
+DEFAULT_EXTENT = 4096
+
+# Units of ScheduleTileV3 timestamps per second
+TIMESTAMP_SCALE = 10
+
+PBF_VERSIONS = ('v2', 'v3')
+
+# gzip compression level used by `gzip -c`
+GZIP_LEVEL = 6
+
+
+def encode_varint(value):
+    """Encode a single unsigned varint"""
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_varints(values):
+    """Encode an array of unsigned integers as consecutive varints
+
+    Args:
+        - values: array-like of non-negative integers
+
+    Returns:
+        bytes
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b''
+
+    # Number of bytes of each varint
+    sizes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        sizes += values >= (np.uint64(1) << np.uint64(shift))
+
+    offsets = np.zeros(len(values), dtype=np.int64)
+    np.cumsum(sizes[:-1], out=offsets[1:])
+
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+    for i in range(int(sizes.max())):
+        mask = sizes > i
+        group = (values[mask] >> np.uint64(7 * i)) & np.uint64(0x7f)
+        # Set the continuation bit on all but the last byte of each varint
+        group |= np.where(sizes[mask] > i + 1, 0x80, 0).astype(np.uint64)
+        out[offsets[mask] + i] = group
+
+    return out.tobytes()
+
+
+def zigzag(values):
+    """Zig-zag encode signed integers, as for sint32 fields"""
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def unzigzag(values):
+    """Decode zig-zag encoded integers"""
+    values = np.asarray(values, dtype=np.uint64)
+    return ((values >> np.uint64(1)).astype(np.int64) ^
+            -(values & np.uint64(1)).astype(np.int64))
+
+
+def decode_varints(data):
+    """Decode consecutive unsigned varints
+
+    Args:
+        - data: bytes
+
+    Returns:
+        np.ndarray of uint64
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if not len(buf):
+        return np.empty(0, dtype=np.uint64)
+
+    # Each varint ends at a byte without the continuation bit
+    ends = np.flatnonzero(buf < 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    values = np.zeros(len(ends), dtype=np.uint64)
+    sizes = ends - starts + 1
+    for i in range(int(sizes.max())):
+        mask = sizes > i
+        group = (buf[starts[mask] + i] & 0x7f).astype(np.uint64)
+        values[mask] |= group << np.uint64(7 * i)
+
+    return values
+
+
+def iter_fields(data):
+    """Generator of (field_number, wire_type, value) of a protobuf message
+
+    value is an int for varint fields, or bytes for length-delimited fields.
+    """
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        else:
+            raise ValueError(f'Unsupported wire type: {wire_type}')
+
+        yield field_number, wire_type, value
+
+
+def read_varint(data, pos):
+    """Read a single varint from data at pos; returns (value, new pos)"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def packed_field(key, payload):
+    """Encode a length-delimited packed field, or nothing if it's empty"""
+    if not payload:
+        return b''
+
+    return encode_varint(key) + encode_varint(len(payload)) + payload
+
+
+def encode_schedule_tile(positions, timestamps, start_indices):
+    """Encode ScheduleTile message
+
+    Args:
+        - positions: array-like of interleaved lon, lat
+        - timestamps: array-like of timestamps, one per coordinate
+        - start_indices: array-like of the index of the first coordinate of
+          each feature, followed by the total number of coordinates
+
+    Returns:
+        bytes
+    """
+    positions = np.asarray(positions, dtype='<f4')
+    timestamps = np.asarray(timestamps, dtype='<f4')
+    n_coords = len(timestamps)
+    assert len(positions) == 2 * n_coords, 'should be 2x positions'
+
+    parts = [
+        packed_field(POSITIONS_KEY, positions.tobytes()),
+        packed_field(TIMESTAMPS_KEY, timestamps.tobytes()),
+        packed_field(START_INDICES_KEY, encode_varints(start_indices)),
+        # length is optional, but always set by geojson_to_pbf.py
+        encode_varint(LENGTH_KEY) + encode_varint(n_coords),
+    ]
+    return b''.join(parts)
+
+
+def encode_features(coords_list):
+    """Encode ScheduleTile message from the coordinates of LineStrings
+
+    Args:
+        - coords_list: list of arrays of shape (n, 3) with lon, lat, time
+
+    Returns:
+        bytes
+    """
+    if not coords_list:
+        return encode_schedule_tile([], [], [0])
+
+    coords = np.concatenate(
+        [np.asarray(c, dtype=np.float64).reshape(-1, 3) for c in coords_list])
+    start_indices = np.zeros(len(coords_list) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in coords_list], out=start_indices[1:])
+
+    return encode_schedule_tile(
+        coords[:, :2].ravel(), coords[:, 2], start_indices)
+
+
+def tile_units(lon, lat, tile, extent=DEFAULT_EXTENT):
+    """Convert lon, lat to integer units of tile, from its top left corner
+
+    Args:
+        - lon: array of longitudes
+        - lat: array of latitudes
+        - tile: mercantile.Tile
+        - extent: number of units per tile side
+
+    Returns:
+        tuple of int64 arrays (x, y)
+    """
+    size = 2 ** tile.z
+    lat = np.clip(lat, -85.0511287798066, 85.0511287798066)
+    mx = (np.asarray(lon, dtype=np.float64) + 180) / 360
+    sin_lat = np.sin(np.radians(lat))
+    my = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+
+    x = np.round((mx * size - tile.x) * extent).astype(np.int64)
+    y = np.round((my * size - tile.y) * extent).astype(np.int64)
+    return x, y
+
+
+def encode_features_v3(coords_list, tile, extent=DEFAULT_EXTENT):
+    """Encode ScheduleTileV3 message from the coordinates of LineStrings
+
+    Args:
+        - coords_list: list of arrays of shape (n, 3) with lon, lat, time
+        - tile: mercantile.Tile the coordinates belong to
+        - extent: number of units per tile side
+
+    Returns:
+        bytes
+    """
+    if coords_list:
+        coords = np.concatenate([
+            np.asarray(c, dtype=np.float64).reshape(-1, 3)
+            for c in coords_list])
+    else:
+        coords = np.empty((0, 3), dtype=np.float64)
+
+    start_indices = np.zeros(len(coords_list) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c in coords_list], out=start_indices[1:])
+    return encode_schedule_tile_v3(coords, start_indices, tile, extent)
+
+
+def encode_schedule_tile_v3(
+        coords, start_indices, tile, extent=DEFAULT_EXTENT):
+    """Encode ScheduleTileV3 message
+
+    Args:
+        - coords: array of shape (n, 3) with lon, lat, time of all features
+        - start_indices: array-like of the index of the first coordinate of
+          each feature, followed by the total number of coordinates
+        - tile: mercantile.Tile the coordinates belong to
+        - extent: number of units per tile side
+
+    Returns:
+        bytes
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+    x, y = tile_units(coords[:, 0], coords[:, 1], tile, extent)
+    xy = np.column_stack([x, y])
+    xy_deltas = np.diff(xy, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    times = np.round(coords[:, 2] * TIMESTAMP_SCALE).astype(np.int64)
+    time_deltas = np.diff(times, prepend=0)
+
+    parts = [
+        encode_varint(V3_Z_KEY) + encode_varint(tile.z),
+        encode_varint(V3_X_KEY) + encode_varint(tile.x),
+        encode_varint(V3_Y_KEY) + encode_varint(tile.y),
+        encode_varint(V3_EXTENT_KEY) + encode_varint(extent),
+        packed_field(
+            V3_POSITIONS_KEY, encode_varints(zigzag(xy_deltas.ravel()))),
+        packed_field(V3_TIMESTAMPS_KEY, encode_varints(zigzag(time_deltas))),
+        packed_field(V3_START_INDICES_KEY, encode_varints(start_indices)),
+        encode_varint(V3_LENGTH_KEY) + encode_varint(len(coords)),
+    ]
+    return b''.join(parts)
+
+
+def decode_schedule_tile_v3(data):
+    """Decode ScheduleTileV3 message to absolute coordinates
+
+    Returns:
+        tuple of (positions, timestamps, start_indices): positions is a
+        float64 array of interleaved lon, lat; timestamps is in seconds
+    """
+    fields = {'extent': DEFAULT_EXTENT}
+    names = {1: 'z', 2: 'x', 3: 'y', 4: 'extent', 8: 'length'}
+    for field_number, _, value in iter_fields(data):
+        if field_number in names:
+            fields[names[field_number]] = value
+        elif field_number == 5:
+            fields['positions'] = unzigzag(decode_varints(value))
+        elif field_number == 6:
+            fields['timestamps'] = unzigzag(decode_varints(value))
+        elif field_number == 7:
+            fields['start_indices'] = decode_varints(value).astype(np.int64)
+
+    xy = np.cumsum(
+        fields.get('positions', np.empty(0, dtype=np.int64)).reshape(-1, 2),
+        axis=0)
+    size = 2 ** fields['z']
+    mx = (fields['x'] + xy[:, 0] / fields['extent']) / size
+    my = (fields['y'] + xy[:, 1] / fields['extent']) / size
+    lon = mx * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * my))))
+    timestamps = np.cumsum(
+        fields.get('timestamps', np.empty(0, dtype=np.int64))) / TIMESTAMP_SCALE
+
+    positions = np.column_stack([lon, lat]).ravel()
+    return positions, timestamps, fields.get('start_indices')
+
+
+def decode_schedule_tile(data):
+    """Decode ScheduleTile message
+
+    Returns:
+        tuple of (positions, timestamps, start_indices)
+    """
+    positions = timestamps = start_indices = None
+    for field_number, _, value in iter_fields(data):
+        if field_number == 1:
+            positions = np.frombuffer(value, dtype='<f4')
+        elif field_number == 2:
+            timestamps = np.frombuffer(value, dtype='<f4')
+        elif field_number == 3:
+            start_indices = decode_varints(value).astype(np.int64)
+
+    return positions, timestamps, start_indices
+
+
+def encode_tile(coords_list, tile, version='v2'):
+    """Encode coordinates of LineStrings in tile with given PBF version"""
+    if version == 'v3':
+        return encode_features_v3(coords_list, tile)
+
+    return encode_features(coords_list)
+
+
+def encode_tile_coords(coords, start_indices, tile, version='v2'):
+    """Encode concatenated coordinates of LineStrings with given PBF version
+
+    Args:
+        - coords: array of shape (n, 3) with lon, lat, time of all features
+        - start_indices: array-like of the index of the first coordinate of
+          each feature, followed by the total number of coordinates
+        - tile: mercantile.Tile the coordinates belong to
+        - version: one of PBF_VERSIONS
+    """
+    if version == 'v3':
+        return encode_schedule_tile_v3(coords, start_indices, tile)
+
+    return encode_schedule_tile(
+        coords[:, :2].ravel(), coords[:, 2], start_indices)
+
+
+def gzip_compress(data):
+    """Compress data with gzip
+
+    The modification time in the header is zeroed, so the same tile always
+    compresses to the same bytes.
+    """
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def gzipped_size(data):
+    """Size of data after gzip compression"""
+    return len(gzip_compress(data))
+
+
+def write_gzipped(path, data):
+    """Write data to path with gzip compression"""
+    with open(path, 'wb') as f:
+        f.write(gzip_compress(data))
+
+
+def estimated_feature_bytes(n_coords):
+    """Upper bound of bytes a LineString adds to an encoded ScheduleTile"""
+    return COORD_BYTES * n_coords + MAX_INDEX_BYTES
+
+
+def time_bucket(timestamp, bucket_seconds):
+    """Start in seconds of the time bucket containing timestamp"""
+    return int(timestamp // bucket_seconds) * bucket_seconds
+
+
+def bucket_dir(pbf_dir, bucket):
+    """Root of the tiles of a time bucket, or pbf_dir if not bucketed
+
+    Each bucket is a complete tile tree named by its start in seconds, e.g.
+    `{pbf_dir}/28800/{z}/{x}/{y}.pbf` holds features entering the tile from
+    08:00 until the next bucket. For an MBTiles `pbf_dir`, buckets are
+    sibling files, see tile_store.sub_store_path.
+    """
+    if bucket is None:
+        return pbf_dir
+
+    return tile_store.sub_store_path(pbf_dir, str(bucket))
+
+
+def group_by_time_bucket(coords_list, bucket_seconds):
+    """Group coordinates of LineStrings by the time bucket of their first vertex
+
+    LineStrings without coordinates have no time and draw nothing, so they're
+    left out of every bucket.
+
+    Args:
+        - coords_list: list of arrays of shape (n, 3) of lon, lat, time
+        - bucket_seconds: length of buckets, or None to keep a single group
+
+    Returns:
+        dict of bucket start in seconds, or None, to list of coordinates
+    """
+    if not bucket_seconds:
+        return {None: coords_list}
+
+    groups = {}
+    for coords in coords_list:
+        if not len(coords):
+            continue
+
+        bucket = time_bucket(coords[0][2], bucket_seconds)
+        groups.setdefault(bucket, []).append(coords)
+
+    return groups
@@ -1,12 +1,27 @@
+import json
+import math
+import multiprocessing
+import queue as queue_module
+import shutil
+import sys
+import tempfile
 from pathlib import Path
 
 import click
 import cligj
 import geojson
 import mercantile
-from shapely.geometry import asShape, box
+import numpy as np
+from shapely.geometry import box, mapping, shape
 from shapely.ops import split
 
+import schedule_tile_pbf
+import tile_store
+
+# Windows use the same filters as select_ssp.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'schedules'))
+import select_ssp  # noqa: E402
+
 
 @click.command()
 @cligj.features_in_arg
@@ -27,7 +42,42 @@ from shapely.ops import split
 @click.option(
     '-d',
     '--tile-dir',
-    type=click.Path(file_okay=False, dir_okay=True, writable=True))
+    type=click.Path(file_okay=True, dir_okay=True, writable=True),
+    help=
+    'Root of directory to write newline-delimited GeoJSON tiles to, or path of an `.mbtiles` file.'
+)
+@click.option(
+    '--pbf-dir',
+    type=click.Path(file_okay=True, dir_okay=True, writable=True),
+    required=False,
+    default=None,
+    help=
+    'Root of directory to write gzipped ScheduleTile PBF tiles to, or path of an `.mbtiles` file. Only LineStrings can be written as PBF.'
+)
+@click.option(
+    '--pbf-version',
+    type=click.Choice(schedule_tile_pbf.PBF_VERSIONS),
+    default='v2',
+    show_default=True,
+    help=
+    'Message written to --pbf-dir: `v2` is ScheduleTile with float positions and timestamps; `v3` is the quantized, delta-encoded ScheduleTileV3.'
+)
+@click.option(
+    '--time-bucket-minutes',
+    type=int,
+    required=False,
+    default=None,
+    help=
+    'If provided, split the PBF tiles into buckets of this many minutes by the time of the first vertex of each feature, written to `{pbf-dir}/{bucket start in seconds}/{z}/{x}/{y}.pbf`.'
+)
+@click.option(
+    '--windows-path',
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    required=False,
+    default=None,
+    help=
+    'JSON file of time windows, e.g. code/tile/windows.json. If provided, each feature is written to `{tile-dir}/{window}` and `{pbf-dir}/{window}` for every window it is in. Features must be tagged by `ssp_geom.py --tag-service`.'
+)
 @click.option(
     '--allowed-geom-type',
     type=str,
@@ -35,8 +85,56 @@ from shapely.ops import split
     multiple=True,
     default=[],
     help='Geometry types to keep in exported GeoJSON features.')
-def cut_geojson(features, min_zoom, max_zoom, tile_dir, allowed_geom_type):
+@click.option(
+    '--buffer-size',
+    type=int,
+    default=256,
+    show_default=True,
+    help=
+    'Max size in MB of tile data buffered in memory before being appended to tile files.'
+)
+@click.option(
+    '--validate',
+    is_flag=True,
+    default=False,
+    help=
+    'Check that the time (third) coordinate of every clipped LineString is non-decreasing. Invalid features are reported on stderr and not written.'
+)
+@click.option(
+    '-j',
+    '--workers',
+    type=int,
+    default=1,
+    show_default=True,
+    help=
+    'Number of worker processes. Each worker exclusively writes the tiles under a subset of the tiles at --partition-zoom.'
+)
+@click.option(
+    '--partition-zoom',
+    type=int,
+    default=8,
+    show_default=True,
+    help=
+    'Zoom of tiles used to partition output between workers. Capped at --min-zoom.'
+)
+def cut_geojson(
+        features, min_zoom, max_zoom, tile_dir, pbf_dir, pbf_version,
+        time_bucket_minutes, windows_path, allowed_geom_type, buffer_size,
+        validate, workers, partition_zoom):
     """Cut GeoJSON features into xyz tiles
+
+    New vertices created where LineStrings cross tile boundaries get a time
+    coordinate linearly interpolated between the neighboring vertices.
+
+    Tiles are written as GeoJSON to --tile-dir, as gzipped PBF to --pbf-dir,
+    or both. With --time-bucket-minutes, a client can fetch the PBF tiles of
+    the bucket it's playing first, and the rest progressively. A feature is
+    in the bucket it enters the tile in, so playing a time also needs the
+    previous bucket for features still moving across the tile.
+
+    With --windows-path, features are clipped once and fanned out to one tile
+    tree per time window, so adding a window costs a tiling pass instead of
+    matching geometries again.
     """
     geometry_types = [
         'Point', 'MultiPoint', 'LineString', 'MultiLineString', 'Polygon',
@@ -44,19 +142,98 @@ def cut_geojson(features, min_zoom, max_zoom, tile_dir, allowed_geom_type):
     if not all(t in geometry_types for t in allowed_geom_type):
         raise ValueError(f'allowed_geom_type must be one of: {geometry_types}')
 
-    tile_dir = Path(tile_dir)
+    if not tile_dir and not pbf_dir:
+        raise click.UsageError(
+            'At least one of --tile-dir and --pbf-dir is required')
+
+    max_buffer_bytes = buffer_size * 1024 * 1024
+    time_bucket_seconds = None
+    if time_bucket_minutes:
+        time_bucket_seconds = time_bucket_minutes * 60
+
+    windows = None
+    if windows_path:
+        windows = load_windows(windows_path)
+
+    if workers > 1:
+        n_invalid = tile_features_in_parallel(
+            features,
+            min_zoom=min_zoom,
+            max_zoom=max_zoom,
+            tile_dir=tile_dir,
+            pbf_dir=pbf_dir,
+            pbf_version=pbf_version,
+            time_bucket_seconds=time_bucket_seconds,
+            windows=windows,
+            allowed_geom_type=allowed_geom_type,
+            validate=validate,
+            max_buffer_bytes=max_buffer_bytes,
+            workers=workers,
+            partition_zoom=min(partition_zoom, min_zoom))
+    else:
+        writers = create_writers(
+            tile_dir, pbf_dir, max_buffer_bytes, pbf_version,
+            time_bucket_seconds, windows)
+        n_invalid = tile_features(
+            features,
+            min_zoom=min_zoom,
+            max_zoom=max_zoom,
+            writers=writers,
+            allowed_geom_type=allowed_geom_type,
+            validate=validate)
+        for writer in writers:
+            writer.close()
+
+    if validate:
+        print(
+            f'{n_invalid} features with non-monotonic times skipped',
+            file=sys.stderr)
+
+
+def tile_features(
+        features,
+        min_zoom,
+        max_zoom,
+        writers,
+        allowed_geom_type=None,
+        validate=False,
+        owns_tile=None):
+    """Clip features to tiles and write them
 
+    Args:
+        - features: iterable of GeoJSON features
+        - min_zoom: min zoom level
+        - max_zoom: max zoom level (inclusive)
+        - writers: list of TileWriter or PbfTileWriter
+        - allowed_geom_type: geometry types to keep; all are kept if empty
+        - validate: skip features with non-monotonic times
+        - owns_tile: optional function of tile; if given, only tiles for which
+          it returns True are written
+
+    Returns:
+        number of features skipped by validation
+    """
+    n_invalid = 0
     for feature in features:
-        geometry = asShape(feature['geometry'])
-        tiles = find_tiles(geometry, min_zoom, max_zoom)
+        # Clipping interpolates times, so only the input needs checking
+        if validate and not times_are_monotonic(feature['geometry']):
+            n_invalid += 1
+            print(
+                f'Non-monotonic times in feature: {feature["properties"]}',
+                file=sys.stderr)
+            continue
+
+        clipped = clip_geometry_to_tiles(
+            feature['geometry'], min_zoom, max_zoom)
 
-        for tile in tiles:
-            clipped_geometries = clip_geometry_to_tile(geometry, tile)
+        for tile, clipped_geometries in clipped:
+            if owns_tile and not owns_tile(tile):
+                continue
 
             new_features = []
             for clipped_geometry in clipped_geometries:
                 if allowed_geom_type:
-                    geom_type = clipped_geometry.type
+                    geom_type = clipped_geometry['type']
                     if geom_type not in allowed_geom_type:
                         print(f'Skipping feature of type: {geom_type}')
                         continue
@@ -67,12 +244,710 @@ def cut_geojson(features, min_zoom, max_zoom, tile_dir, allowed_geom_type):
                         properties=feature['properties']))
 
             # Write feature to tile_dir
-            this_tile_dir = (tile_dir / str(tile.z) / str(tile.x))
+            for new_feature in new_features:
+                for writer in writers:
+                    writer.write_feature(tile, new_feature)
+
+    return n_invalid
+
+
+# Number of features sent to a tiling worker at once
+FEATURE_BATCH_SIZE = 1000
+
+# Number of PBF tiles written to a tile store at once
+PBF_WRITE_BATCH_SIZE = 256
+
+
+def create_writers(
+        tile_dir, pbf_dir, max_buffer_bytes, pbf_version='v2',
+        time_bucket_seconds=None, windows=None):
+    """Create tile writers, dividing the buffer size between them
+
+    With windows, returns a single WindowWriter with writers of each window's
+    tile trees, under `{tile_dir}/{window}` and `{pbf_dir}/{window}`, or in
+    sibling `.mbtiles` files, see tile_store.sub_store_path.
+    """
+    if windows:
+        window_writers = {}
+        for name in windows:
+            window_writers[name] = create_writers(
+                tile_dir and tile_store.sub_store_path(tile_dir, name),
+                pbf_dir and tile_store.sub_store_path(pbf_dir, name),
+                max_buffer_bytes // len(windows), pbf_version,
+                time_bucket_seconds)
+        return [WindowWriter(windows, window_writers)]
+
+    n_writers = bool(tile_dir) + bool(pbf_dir)
+    writers = []
+    if tile_dir:
+        writers.append(
+            TileWriter(
+                tile_dir, max_buffer_bytes=max_buffer_bytes // n_writers))
+    if pbf_dir:
+        writers.append(
+            PbfTileWriter(
+                pbf_dir,
+                max_buffer_bytes=max_buffer_bytes // n_writers,
+                version=pbf_version,
+                time_bucket_seconds=time_bucket_seconds))
+
+    return writers
+
+
+def tile_features_in_parallel(
+        features, min_zoom, max_zoom, tile_dir, pbf_dir, pbf_version,
+        time_bucket_seconds, windows, allowed_geom_type, validate,
+        max_buffer_bytes, workers, partition_zoom):
+    """Clip features to tiles and write them using multiple processes
+
+    Output tiles are partitioned by their ancestor at `partition_zoom`, and
+    each partition is owned by exactly one worker, so no two processes ever
+    append to the same tile file. Features are validated here, and sent to
+    the workers owning any partition their bounding box touches. Lines
+    touching the partitions of several workers are split with
+    `split_lines_by_owner`, so that each worker only clips the segments in
+    its partitions. Features are sent in input order, so every tile file has
+    the same contents as with a single process.
+
+    Returns:
+        number of features skipped by validation
+    """
+    assert partition_zoom <= min_zoom, 'partition zoom must be <= min zoom'
+
+    ctx = multiprocessing.get_context('fork')
+    queues = [ctx.Queue(maxsize=16) for _ in range(workers)]
+    processes = []
+    for worker in range(workers):
+        args = (
+            worker, workers, queues[worker], min_zoom, max_zoom,
+            tile_dir, pbf_dir, pbf_version, time_bucket_seconds, windows,
+            allowed_geom_type, max_buffer_bytes // workers, partition_zoom)
+        p = ctx.Process(target=tiling_worker, args=args)
+        p.start()
+        processes.append(p)
+
+    try:
+        n_invalid = dispatch_features(
+            features, queues, processes, partition_zoom, validate)
+    except BaseException:
+        # Workers would otherwise wait forever for their sentinel
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.join()
+        raise
+
+    # Raise if a worker failed, since its tiles are incomplete
+    for p in processes:
+        p.join()
+        if p.exitcode != 0:
+            raise RuntimeError(f'Tiling worker exited with code {p.exitcode}')
+
+    return n_invalid
+
+
+def dispatch_features(features, queues, processes, partition_zoom, validate):
+    """Send features to the tiling workers owning their partitions
+
+    Ends by sending every worker its sentinel.
+
+    Returns:
+        number of features skipped by validation
+    """
+    workers = len(queues)
+    n_invalid = 0
+    batches = [[] for _ in range(workers)]
+    for feature in features:
+        geometry = feature['geometry']
+        if validate and not times_are_monotonic(geometry):
+            n_invalid += 1
+            print(
+                f'Non-monotonic times in feature: {feature["properties"]}',
+                file=sys.stderr)
+            continue
+
+        bounds = shape(geometry).bounds
+        owner_features = {
+            partition_owner(t, workers): feature
+            for t in mercantile.tiles(*bounds, zooms=[partition_zoom])}
+
+        # Only send each worker the parts of lines in its partitions
+        is_line = geometry['type'] in ['LineString', 'MultiLineString']
+        if is_line and len(owner_features) > 1:
+            lines = geometry['coordinates']
+            if geometry['type'] == 'LineString':
+                lines = [lines]
+
+            lines_by_owner = split_lines_by_owner(
+                lines, partition_zoom, workers)
+            owner_features = {
+                owner: {
+                    'type': 'Feature',
+                    'geometry': {
+                        'type': 'MultiLineString',
+                        'coordinates': owner_lines},
+                    'properties': feature['properties']}
+                for owner, owner_lines in lines_by_owner.items()}
+
+        for owner, owner_feature in owner_features.items():
+            batches[owner].append(owner_feature)
+            if len(batches[owner]) >= FEATURE_BATCH_SIZE:
+                put_batch(queues[owner], batches[owner], processes[owner])
+                batches[owner] = []
+
+    for worker in range(workers):
+        if batches[worker]:
+            put_batch(queues[worker], batches[worker], processes[worker])
+        put_batch(queues[worker], None, processes[worker])
+
+    return n_invalid
+
+
+def split_lines_by_owner(lines, partition_zoom, workers):
+    """Split lines into the runs of segments touching each worker's partitions
+
+    A segment can only cross the tiles within the box of the tiles of its two
+    vertices, so it's assigned to the owners of those partitions. Runs keep
+    the original vertices, so that clipping them gives exactly the same
+    pieces in owned tiles as clipping the whole line.
+
+    Args:
+        - lines: list of lists of [lon, lat, ...] coordinates
+        - partition_zoom: zoom of partition tiles
+        - workers: number of workers
+
+    Returns:
+        dict of worker index to list of runs, each a list of coordinates
+    """
+    n_tiles = 2**partition_zoom
+    runs_by_owner = {}
+    for line in lines:
+        tiles = []
+        for lon, lat, *_ in line:
+            x, y = fractional_tile(lon, lat, partition_zoom)
+            tiles.append((
+                min(max(int(x), 0), n_tiles - 1),
+                min(max(int(y), 0), n_tiles - 1)))
+
+        # Index of the last vertex of each owner's current run
+        run_ends = {}
+        for i, ((x0, y0), (x1, y1)) in enumerate(zip(tiles, tiles[1:])):
+            owners = {
+                partition_owner(mercantile.Tile(x, y, partition_zoom), workers)
+                for x in range(min(x0, x1), max(x0, x1) + 1)
+                for y in range(min(y0, y1), max(y0, y1) + 1)}
+            for owner in owners:
+                runs = runs_by_owner.setdefault(owner, [])
+                if run_ends.get(owner) == i:
+                    runs[-1].append(line[i + 1])
+                else:
+                    runs.append([line[i], line[i + 1]])
+                run_ends[owner] = i + 1
+
+    return runs_by_owner
+
+
+def put_batch(queue, batch, process):
+    """Put batch on a worker's queue, raising if the worker has died"""
+    while True:
+        try:
+            queue.put(batch, timeout=1)
+            return
+        except queue_module.Full:
+            if not process.is_alive():
+                raise RuntimeError(
+                    f'Tiling worker exited with code {process.exitcode}')
+
+
+def tiling_worker(
+        worker, workers, queue, min_zoom, max_zoom, tile_dir,
+        pbf_dir, pbf_version, time_bucket_seconds, windows, allowed_geom_type,
+        max_buffer_bytes, partition_zoom):
+    """Tile features from queue, writing only tiles owned by this worker"""
+    def owns_tile(tile):
+        if tile.z > partition_zoom:
+            tile = mercantile.parent(tile, zoom=partition_zoom)
+        return partition_owner(tile, workers) == worker
+
+    def iter_queue():
+        while True:
+            batch = queue.get()
+            if batch is None:
+                return
+            yield from batch
+
+    writers = create_writers(
+        tile_dir, pbf_dir, max_buffer_bytes, pbf_version, time_bucket_seconds,
+        windows)
+    tile_features(
+        iter_queue(),
+        min_zoom=min_zoom,
+        max_zoom=max_zoom,
+        writers=writers,
+        allowed_geom_type=allowed_geom_type,
+        owns_tile=owns_tile)
+    for writer in writers:
+        writer.close()
+
+
+def partition_owner(tile, workers):
+    """Index of worker owning a partition tile"""
+    return hash((tile.x, tile.y)) % workers
+
+
+class TileWriter:
+    """Buffered writer of newline-delimited GeoJSON tiles
+
+    Lines are buffered in memory per tile and appended to
+    `{tile_dir}/{z}/{x}/{y}.geojson` once the total buffered size passes
+    `max_buffer_bytes`, and on `close`. This way each tile file is opened once
+    per flush instead of once per feature, and each directory is created once.
+    If `tile_dir` is an `.mbtiles` file, each flush is a single transaction.
+    """
+    def __init__(self, tile_dir, max_buffer_bytes=256 * 1024 * 1024):
+        super(TileWriter, self).__init__()
+        self.store = tile_store.open_tile_store(tile_dir, '.geojson')
+        self.max_buffer_bytes = max_buffer_bytes
+        self.buffers = {}
+        self.buffer_bytes = 0
+
+    def write_feature(self, tile, feature):
+        self.write(tile, geojson.dumps(feature, separators=(',', ':')))
+
+    def write(self, tile, line):
+        self.buffers.setdefault(tile, []).append(line)
+        self.buffer_bytes += len(line) + 1
+        if self.buffer_bytes >= self.max_buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        self.store.append_tiles(
+            (tile, ('\n'.join(lines) + '\n').encode())
+            for tile, lines in self.buffers.items())
+
+        self.buffers = {}
+        self.buffer_bytes = 0
+
+    def close(self):
+        self.flush()
+        self.store.close()
+
+
+class PbfTileWriter:
+    """Buffered writer of gzipped ScheduleTile PBF tiles
+
+    Coordinates of LineStrings are buffered in memory per tile, as float32
+    arrays for `v2`, the precision of its PBF, or float64 arrays for `v3`,
+    which is quantized on close. Once the total buffered size passes
+    `max_buffer_bytes`, they're appended to uncompressed
+    `{pbf_dir}/{z}/{x}/{y}.coords` and `{y}.lengths` files. On `close`, each
+    tile is encoded, gzipped and written to `{pbf_dir}/{z}/{x}/{y}.pbf`, and
+    the intermediate files are removed. If `pbf_dir` is an `.mbtiles` file,
+    intermediate files go to a temporary directory next to it instead.
+
+    With `time_bucket_seconds`, features are further split by the time of
+    their first vertex, and each bucket is written as its own tile tree under
+    `{pbf_dir}/{bucket}`, named by the bucket's start in seconds.
+    """
+    def __init__(
+            self, pbf_dir, max_buffer_bytes=256 * 1024 * 1024, version='v2',
+            time_bucket_seconds=None):
+        super(PbfTileWriter, self).__init__()
+        self.pbf_dir = Path(pbf_dir)
+        self.max_buffer_bytes = max_buffer_bytes
+        self.version = version
+        self.time_bucket_seconds = time_bucket_seconds
+        self.dtype = '<f8' if version == 'v3' else '<f4'
+        # Keyed by (bucket, tile); bucket is None without time buckets
+        self.buffers = {}
+        self.buffer_bytes = 0
+        self.spilled_keys = set()
+        self.created_dirs = set()
+        self.scratch_dir = None
+        # Tile store of each time bucket
+        self.stores = {}
+
+    def write_feature(self, tile, feature):
+        geom_type = feature['geometry']['type']
+        if geom_type != 'LineString':
+            raise ValueError(
+                f'Only LineStrings can be written to PBF, got {geom_type}')
+
+        coords = np.asarray(
+            feature['geometry']['coordinates'], dtype=self.dtype)
+        bucket = None
+        if self.time_bucket_seconds:
+            bucket = schedule_tile_pbf.time_bucket(
+                coords[0, 2], self.time_bucket_seconds)
+
+        self.buffers.setdefault((bucket, tile), []).append(coords)
+        self.buffer_bytes += coords.nbytes
+        if self.buffer_bytes >= self.max_buffer_bytes:
+            self.flush()
+
+    def tile_path(self, key, ext):
+        """Path of intermediate file of a tile"""
+        if self.scratch_dir is None:
+            if tile_store.is_mbtiles(self.pbf_dir):
+                self.scratch_dir = Path(
+                    tempfile.mkdtemp(
+                        prefix=f'.{self.pbf_dir.name}-',
+                        dir=self.pbf_dir.parent))
+            else:
+                self.scratch_dir = self.pbf_dir
+
+        bucket, tile = key
+        root = self.scratch_dir
+        if bucket is not None:
+            root = root / str(bucket)
+        this_tile_dir = root / str(tile.z) / str(tile.x)
+        if this_tile_dir not in self.created_dirs:
             this_tile_dir.mkdir(parents=True, exist_ok=True)
-            with open(this_tile_dir / f'{str(tile.y)}.geojson', 'a') as f:
-                for new_feature in new_features:
-                    f.write(geojson.dumps(new_feature, separators=(',', ':')))
-                    f.write('\n')
+            self.created_dirs.add(this_tile_dir)
+
+        return this_tile_dir / f'{str(tile.y)}{ext}'
+
+    def flush(self):
+        for key, coords_list in self.buffers.items():
+            lengths = np.array([len(c) for c in coords_list], dtype='<u4')
+            with open(self.tile_path(key, '.coords'), 'ab') as f:
+                f.write(np.concatenate(coords_list).tobytes())
+            with open(self.tile_path(key, '.lengths'), 'ab') as f:
+                f.write(lengths.tobytes())
+
+            self.spilled_keys.add(key)
+
+        self.buffers = {}
+        self.buffer_bytes = 0
+
+    def close(self):
+        # Encoded tiles of each time bucket not yet written to its store
+        encoded_tiles = {}
+        for key in self.spilled_keys | set(self.buffers):
+            coords = [np.empty((0, 3), dtype=self.dtype)]
+            lengths = [np.empty(0, dtype=np.int64)]
+            if key in self.spilled_keys:
+                coords_path = self.tile_path(key, '.coords')
+                lengths_path = self.tile_path(key, '.lengths')
+                coords.append(
+                    np.fromfile(coords_path, dtype=self.dtype).reshape(-1, 3))
+                lengths.append(np.fromfile(lengths_path, dtype='<u4'))
+                coords_path.unlink()
+                lengths_path.unlink()
+
+            buffered = self.buffers.get(key, [])
+            coords.extend(buffered)
+            lengths.append(
+                np.array([len(c) for c in buffered], dtype=np.int64))
+
+            coords = np.concatenate(coords)
+            lengths = np.concatenate(lengths).astype(np.int64)
+            start_indices = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=start_indices[1:])
+
+            bucket, tile = key
+            encoded = schedule_tile_pbf.encode_tile_coords(
+                coords, start_indices, tile, self.version)
+            pending = encoded_tiles.setdefault(bucket, [])
+            pending.append((tile, schedule_tile_pbf.gzip_compress(encoded)))
+            if len(pending) >= PBF_WRITE_BATCH_SIZE:
+                self.write_tiles(bucket, pending)
+                encoded_tiles[bucket] = []
+
+        for bucket, pending in encoded_tiles.items():
+            self.write_tiles(bucket, pending)
+        for store in self.stores.values():
+            store.close()
+
+        self.buffers = {}
+        self.buffer_bytes = 0
+        self.spilled_keys = set()
+        self.stores = {}
+
+        if self.scratch_dir is not None and self.scratch_dir != self.pbf_dir:
+            shutil.rmtree(self.scratch_dir)
+        self.scratch_dir = None
+
+    def write_tiles(self, bucket, items):
+        """Write (tile, gzipped PBF) items to the store of a time bucket"""
+        if bucket not in self.stores:
+            self.stores[bucket] = tile_store.open_tile_store(
+                schedule_tile_pbf.bucket_dir(self.pbf_dir, bucket), '.pbf')
+
+        self.stores[bucket].write_tiles(items)
+
+
+class WindowWriter:
+    """Writer fanning features out to the writers of their time windows
+
+    Which windows a feature is in only depends on its properties, which are
+    shared by all of its clipped pieces, so it's computed once per feature.
+    """
+    def __init__(self, windows, window_writers):
+        super(WindowWriter, self).__init__()
+        self.windows = windows
+        self.window_writers = window_writers
+        self.last_properties = None
+        self.last_writers = []
+
+    def write_feature(self, tile, feature):
+        properties = feature['properties']
+        if properties is not self.last_properties:
+            self.last_properties = properties
+            self.last_writers = [
+                writer for name, window in self.windows.items()
+                if feature_in_window(properties, window)
+                for writer in self.window_writers[name]]
+
+        for writer in self.last_writers:
+            writer.write_feature(tile, feature)
+
+    def close(self):
+        for writers in self.window_writers.values():
+            for writer in writers:
+                writer.close()
+
+
+def load_windows(path):
+    """Load time windows from JSON file
+
+    The file is an object of window name to filters, with the same meaning as
+    the options of `code/schedules/select_ssp.py`, e.g.
+    ```json
+    {
+      "4_16-20": {
+        "service_date": "2020-02-07",
+        "service_days_of_week": [4],
+        "origin_departure_hour": [16, 20]
+      }
+    }
+    ```
+    All filters are optional. Returns dict of window name to dict with
+    `days_mask`, `start_seconds`, `end_seconds` and `service_julian`, each
+    None if not filtered on.
+    """
+    with open(path) as f:
+        config = json.load(f)
+
+    windows = {}
+    for name, filters in config.items():
+        hours = filters.get('origin_departure_hour') or []
+        assert len(hours) <= 2, 'origin_departure_hour has at most 2 elements'
+
+        days = filters.get('service_days_of_week') or []
+        windows[name] = {
+            'days_mask': select_ssp.days_of_week_mask(days) or None,
+            'start_seconds': hours[0] * 60 * 60 if hours else None,
+            'end_seconds': hours[1] * 60 * 60 if len(hours) > 1 else None,
+            'service_julian': select_ssp.julian_day(
+                filters.get('service_date') or None),
+        }
+
+    return windows
+
+
+def feature_in_window(properties, window):
+    """Check if feature tagged by `ssp_geom.py --tag-service` is in window
+
+    Matches the filters of select_ssp.generate_query.
+    """
+    try:
+        departure = properties['origin_departure_seconds']
+        days_mask = properties['service_days_of_week_mask']
+        start_julian = properties['service_start_julian']
+        end_julian = properties['service_end_julian']
+    except KeyError as e:
+        raise ValueError(
+            f'Feature missing {e} property; tag features with ssp_geom.py --tag-service'
+        )
+
+    start, end = window['start_seconds'], window['end_seconds']
+    if start is not None and departure < start:
+        return False
+    if end is not None and departure >= end:
+        return False
+
+    if window['days_mask'] is not None and not days_mask & window['days_mask']:
+        return False
+
+    day = window['service_julian']
+    if day is not None and not start_julian <= day < end_julian:
+        return False
+
+    return True
+
+
+def clip_geometry_to_tiles(geometry, min_zoom, max_zoom):
+    """Clip GeoJSON geometry to every tile it intersects
+
+    LineStrings and MultiLineStrings are clipped in a single pass over their
+    coordinates with `clip_line_to_tiles`. Other geometry types are split by
+    each intersecting tile's box with shapely.
+
+    Args:
+        - geometry: GeoJSON geometry dict
+        - min_zoom: min zoom level
+        - max_zoom: max zoom level (inclusive)
+
+    Returns:
+        list of (mercantile.Tile, list of GeoJSON geometry dicts)
+    """
+    assert min_zoom <= max_zoom, 'min zoom must be <= max zoom'
+
+    geom_type = geometry['type']
+    if geom_type in ['LineString', 'MultiLineString']:
+        lines = geometry['coordinates']
+        if geom_type == 'LineString':
+            lines = [lines]
+
+        result = []
+        for zoom in range(min_zoom, max_zoom + 1):
+            pieces_by_tile = {}
+            for line in lines:
+                for tile, pieces in clip_line_to_tiles(line, zoom).items():
+                    pieces_by_tile.setdefault(tile, []).extend(pieces)
+
+            for tile, pieces in pieces_by_tile.items():
+                geoms = [{
+                    'type': 'LineString',
+                    'coordinates': piece} for piece in pieces]
+                result.append((tile, geoms))
+
+        return result
+
+    geometry = shape(geometry)
+    result = []
+    for tile in find_tiles(geometry, min_zoom, max_zoom):
+        geoms = [mapping(g) for g in clip_geometry_to_tile(geometry, tile)]
+        result.append((tile, geoms))
+
+    return result
+
+
+def clip_line_to_tiles(coords, zoom):
+    """Clip line to tiles of a zoom level in a single pass
+
+    Each segment is split where it crosses tile boundaries, and each resulting
+    piece is assigned to the tile containing its midpoint. Crossing points are
+    computed by linear interpolation along the segment in longitude/latitude,
+    so that they lie on the original geometry, and any further coordinate
+    dimensions (e.g. time) are interpolated with the same fraction.
+
+    Args:
+        - coords: list of coordinates, each [lon, lat, ...]
+        - zoom: zoom level
+
+    Returns:
+        dict of mercantile.Tile to list of pieces, where each piece is a list of
+        coordinates with at least two distinct points.
+    """
+    n_tiles = 2**zoom
+    pieces_by_tile = {}
+    current_tile = None
+    current_piece = None
+
+    def finish_piece():
+        if current_piece is not None and len(current_piece) >= 2:
+            pieces_by_tile.setdefault(current_tile, []).append(current_piece)
+
+    for p0, p1 in zip(coords, coords[1:]):
+        if p0[:2] == p1[:2]:
+            continue
+
+        fx0, fy0 = fractional_tile(p0[0], p0[1], zoom)
+        fx1, fy1 = fractional_tile(p1[0], p1[1], zoom)
+
+        # Fractions along the segment where it crosses a tile boundary, with
+        # the boundary's exact lon or lat
+        crossings = []
+        for k in range(math.floor(min(fx0, fx1)) + 1,
+                       math.ceil(max(fx0, fx1))):
+            lon = k / n_tiles * 360 - 180
+            crossings.append(((lon - p0[0]) / (p1[0] - p0[0]), 0, lon))
+        for k in range(math.floor(min(fy0, fy1)) + 1,
+                       math.ceil(max(fy0, fy1))):
+            lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * k / n_tiles))))
+            crossings.append(((lat - p0[1]) / (p1[1] - p0[1]), 1, lat))
+
+        crossings.sort()
+
+        prev_frac = 0
+        prev_point = list(p0)
+        for frac, axis, value in crossings + [(1, None, None)]:
+            if axis is None:
+                point = list(p1)
+            else:
+                point = interpolate_coord(p0, p1, frac)
+                point[axis] = value
+
+            if frac <= prev_frac:
+                continue
+
+            # Tile containing the middle of this part of the segment
+            mid = (prev_frac + frac) / 2
+            mx, my = fractional_tile(
+                p0[0] + mid * (p1[0] - p0[0]), p0[1] + mid * (p1[1] - p0[1]),
+                zoom)
+            tile = mercantile.Tile(
+                min(max(int(mx), 0), n_tiles - 1),
+                min(max(int(my), 0), n_tiles - 1), zoom)
+
+            if tile != current_tile:
+                finish_piece()
+                current_tile = tile
+                current_piece = [prev_point]
+
+            if point[:2] != current_piece[-1][:2]:
+                current_piece.append(point)
+
+            prev_frac = frac
+            prev_point = point
+
+    finish_piece()
+    return pieces_by_tile
+
+
+def times_are_monotonic(geometry):
+    """Check that times of each line of a 3D (Multi)LineString are non-decreasing
+
+    Geometries that aren't (Multi)LineStrings, or that have no third
+    coordinate, are considered valid.
+
+    Args:
+        - geometry: GeoJSON geometry dict
+    """
+    if geometry['type'] == 'LineString':
+        lines = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiLineString':
+        lines = geometry['coordinates']
+    else:
+        return True
+
+    for coords in lines:
+        if not coords or len(coords[0]) < 3:
+            continue
+        if not all(a[2] <= b[2] for a, b in zip(coords, coords[1:])):
+            return False
+
+    return True
+
+
+def fractional_tile(lon, lat, zoom):
+    """Fractional x, y tile coordinates of lon, lat at zoom
+
+    The same Web Mercator projection as `mercantile.tile`, without flooring.
+    """
+    lat = min(max(lat, -85.051129), 85.051129)
+    n_tiles = 2**zoom
+    x = (lon + 180) / 360 * n_tiles
+    sin_lat = math.sin(math.radians(lat))
+    y = (0.5 - 0.25 * math.log((1 + sin_lat) / (1 - sin_lat)) / math.pi) * n_tiles
+    return x, y
+
+
+def interpolate_coord(p0, p1, frac):
+    """Linearly interpolate every dimension between two coordinates"""
+    return [a + frac * (b - a) for a, b in zip(p0, p1)]
 
 
 def find_tiles(geometry, min_zoom, max_zoom):
@@ -0,0 +1,323 @@
+"""
+tile_store.py: Read and write tiles in a directory tree or an MBTiles file
+
+Tilers write tiles through a store opened with `open_tile_store`. A path
+ending in `.mbtiles` is an MBTiles (SQLite) file; anything else is a directory
+with one file per tile at `{root}/{z}/{x}/{y}{ext}`.
+
+MBTiles stores use the deduplicated layout of the spec: tile contents are
+stored once in `images`, keyed by their hash, and `map` points each tile at
+its contents, with the `tiles` view joining the two. Identical tiles, like
+overview tiles copied from their only child, then take no extra space. Each
+call to `write_tiles` or `append_tiles` is a single transaction, and several
+processes can read and write the same store, waiting for each other's
+transactions.
+Appended data is staged in a `tile_chunks` table and merged into the tiles on
+`close`, so appending doesn't rewrite the whole tile every time.
+
+`code/tile/export_tiles.py` writes a store out to the directory layout.
+"""
+import hashlib
+import os
+import sqlite3
+from pathlib import Path
+
+import mercantile
+
+MBTILES_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS map (
+    zoom_level INTEGER,
+    tile_column INTEGER,
+    tile_row INTEGER,
+    tile_id TEXT,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+);
+CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB);
+CREATE VIEW IF NOT EXISTS tiles AS
+    SELECT
+        map.zoom_level AS zoom_level,
+        map.tile_column AS tile_column,
+        map.tile_row AS tile_row,
+        images.tile_data AS tile_data
+    FROM map JOIN images ON images.tile_id = map.tile_id;
+CREATE TABLE IF NOT EXISTS tile_chunks (
+    zoom_level INTEGER,
+    tile_column INTEGER,
+    tile_row INTEGER,
+    chunk BLOB
+);
+CREATE INDEX IF NOT EXISTS tile_chunks_tile_idx
+    ON tile_chunks(zoom_level, tile_column, tile_row);
+'''
+
+# Seconds to wait for other processes writing to the same MBTiles file
+MBTILES_TIMEOUT = 600
+
+# Number of tiles whose appended chunks are merged in one transaction
+MERGE_BATCH_SIZE = 1000
+
+# Stores opened by open_tile_store, by path and extension
+OPEN_STORES = {}
+
+
+def is_mbtiles(path):
+    """Check if path is an MBTiles file instead of a directory"""
+    return str(path).endswith('.mbtiles')
+
+
+def open_tile_store(path, ext):
+    """Open tile store at path, reusing a store already opened at path
+
+    Args:
+        - path: directory, or path of MBTiles file ending in `.mbtiles`
+        - ext: extension of tile files, e.g. `.geojson` or `.pbf`. Stored as
+          the `format` of MBTiles files.
+    """
+    key = (str(path), ext)
+    if key not in OPEN_STORES:
+        if is_mbtiles(path):
+            OPEN_STORES[key] = MBTilesTileStore(path, ext)
+        else:
+            OPEN_STORES[key] = DirectoryTileStore(path, ext)
+
+    return OPEN_STORES[key]
+
+
+def close_tile_stores():
+    """Close every store opened by open_tile_store"""
+    for store in list(OPEN_STORES.values()):
+        store.close()
+
+
+def sub_store_path(path, name):
+    """Path of a named subtree of a store, e.g. a time window or bucket
+
+    `{root}/{name}` for directories, and a sibling `{stem}-{name}.mbtiles`
+    file for MBTiles.
+    """
+    path = Path(path)
+    if is_mbtiles(path):
+        return path.with_name(f'{path.stem}-{name}{path.suffix}')
+
+    return path / name
+
+
+class DirectoryTileStore:
+    """Tiles stored as files at `{root}/{z}/{x}/{y}{ext}`"""
+    def __init__(self, root, ext):
+        super(DirectoryTileStore, self).__init__()
+        self.path = Path(root)
+        self.ext = ext
+        self.created_dirs = set()
+
+    def tile_path(self, tile, create=False):
+        this_tile_dir = self.path / str(tile.z) / str(tile.x)
+        if create and this_tile_dir not in self.created_dirs:
+            this_tile_dir.mkdir(parents=True, exist_ok=True)
+            self.created_dirs.add(this_tile_dir)
+
+        return this_tile_dir / f'{tile.y}{self.ext}'
+
+    def read_tile(self, tile):
+        """Contents of tile, or None if it doesn't exist"""
+        try:
+            with open(self.tile_path(tile), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write_tiles(self, items):
+        """Write (tile, bytes) items, replacing existing tiles"""
+        for tile, data in items:
+            with open(self.tile_path(tile, create=True), 'wb') as f:
+                f.write(data)
+
+    def append_tiles(self, items):
+        """Append (tile, bytes) items to existing tiles"""
+        for tile, data in items:
+            with open(self.tile_path(tile, create=True), 'ab') as f:
+                f.write(data)
+
+    def write_tile(self, tile, data):
+        self.write_tiles([(tile, data)])
+
+    def iter_tiles(self, zoom=None):
+        """Generator of existing tiles, optionally of a single zoom"""
+        if not self.path.exists():
+            return
+
+        zoom_dirs = [self.path / str(zoom)] if zoom is not None else [
+            p for p in self.path.iterdir() if p.name.isdigit()]
+        for zoom_dir in zoom_dirs:
+            for path in zoom_dir.glob(f'*/*{self.ext}'):
+                yield mercantile.Tile(
+                    int(path.parent.name), int(path.name[:-len(self.ext)]),
+                    int(zoom_dir.name))
+
+    def iter_tile_data(self, zoom=None):
+        """Generator of (tile, bytes) of existing tiles"""
+        for tile in self.iter_tiles(zoom):
+            yield tile, self.read_tile(tile)
+
+    def close(self):
+        OPEN_STORES.pop((str(self.path), self.ext), None)
+
+
+class MBTilesTileStore:
+    """Tiles stored in an MBTiles file with deduplicated contents
+
+    The connection is opened lazily by each process, since SQLite connections
+    can't be shared across `fork`.
+    """
+    def __init__(self, path, ext):
+        super(MBTilesTileStore, self).__init__()
+        self.path = Path(path)
+        self.ext = ext
+        self.conn = None
+        self.pid = None
+
+    @property
+    def connection(self):
+        if self.conn is None or self.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.conn = sqlite3.connect(self.path, timeout=MBTILES_TIMEOUT)
+            self.pid = os.getpid()
+            # Tiles can be rebuilt from their inputs, so durability isn't
+            # needed. Without WAL, nothing is left to checkpoint when pool
+            # workers exit without closing their connection.
+            self.conn.execute('PRAGMA synchronous = OFF;')
+            with self.conn:
+                self.conn.executescript(MBTILES_SCHEMA)
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO metadata VALUES (?, ?);',
+                    [('name', self.path.stem),
+                     ('format', self.ext.lstrip('.'))])
+
+        return self.conn
+
+    def read_tile(self, tile):
+        """Contents of tile, or None if it doesn't exist"""
+        row = self.connection.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND '
+            'tile_column = ? AND tile_row = ?;', tms_key(tile)).fetchone()
+        return row[0] if row else None
+
+    def write_tiles(self, items):
+        """Write (tile, bytes) items, replacing existing tiles"""
+        conn = self.connection
+        with conn:
+            self._write(conn, items)
+
+    def append_tiles(self, items):
+        """Append (tile, bytes) items to existing tiles
+
+        Data is staged until `close`, and isn't returned by `read_tile` before.
+        """
+        conn = self.connection
+        with conn:
+            conn.executemany(
+                'INSERT INTO tile_chunks VALUES (?, ?, ?, ?);',
+                ((*tms_key(tile), data) for tile, data in items))
+
+    def merge_chunks(self):
+        """Append staged chunks to their tiles, in order of appending
+
+        Tiles are merged in batches, each in one transaction that reads and
+        deletes all of their chunks, so chunks appended by other processes in
+        the meantime are merged later, after the existing contents.
+        """
+        conn = self.connection
+        keys = conn.execute(
+            'SELECT DISTINCT zoom_level, tile_column, tile_row '
+            'FROM tile_chunks;').fetchall()
+        for i in range(0, len(keys), MERGE_BATCH_SIZE):
+            with conn:
+                # Take the write lock before reading, so no other process can
+                # merge the same chunks
+                conn.execute('BEGIN IMMEDIATE;')
+                merged = []
+                for key in keys[i:i + MERGE_BATCH_SIZE]:
+                    z, x, row = key
+                    tile = mercantile.Tile(x, (1 << z) - 1 - row, z)
+                    chunks = [
+                        chunk for chunk, in conn.execute(
+                            'SELECT chunk FROM tile_chunks WHERE '
+                            'zoom_level = ? AND tile_column = ? AND '
+                            'tile_row = ? ORDER BY rowid;', key)]
+                    if not chunks:
+                        continue
+
+                    existing = conn.execute(
+                        'SELECT tile_data FROM tiles WHERE zoom_level = ? AND '
+                        'tile_column = ? AND tile_row = ?;', key).fetchone()
+                    if existing:
+                        chunks.insert(0, existing[0])
+                    merged.append((tile, b''.join(chunks)))
+                    conn.execute(
+                        'DELETE FROM tile_chunks WHERE zoom_level = ? AND '
+                        'tile_column = ? AND tile_row = ?;', key)
+
+                self._write(conn, merged)
+
+    def _write(self, conn, items):
+        images = {}
+        rows = []
+        for tile, data in items:
+            tile_id = hashlib.blake2b(data, digest_size=16).hexdigest()
+            images[tile_id] = data
+            rows.append((*tms_key(tile), tile_id))
+
+        conn.executemany(
+            'INSERT OR IGNORE INTO images VALUES (?, ?);', images.items())
+        conn.executemany(
+            'INSERT OR REPLACE INTO map VALUES (?, ?, ?, ?);', rows)
+
+    def write_tile(self, tile, data):
+        self.write_tiles([(tile, data)])
+
+    def iter_tiles(self, zoom=None):
+        """Generator of existing tiles, optionally of a single zoom"""
+        columns = 'zoom_level, tile_column, tile_row'
+        for z, x, row in self._select(columns, zoom):
+            yield mercantile.Tile(x, (1 << z) - 1 - row, z)
+
+    def iter_tile_data(self, zoom=None):
+        """Generator of (tile, bytes) of existing tiles"""
+        columns = 'zoom_level, tile_column, tile_row, tile_data'
+        for z, x, row, data in self._select(columns, zoom, view='tiles'):
+            yield mercantile.Tile(x, (1 << z) - 1 - row, z), data
+
+    def _select(self, columns, zoom=None, view='map'):
+        query = f'SELECT {columns} FROM {view}'
+        params = ()
+        if zoom is not None:
+            query += ' WHERE zoom_level = ?'
+            params = (zoom, )
+
+        return self.connection.execute(query, params)
+
+    def close(self):
+        """Merge staged chunks, remove unreferenced contents, and close
+
+        Tiles may have been written by other processes that never closed the
+        store, like pool workers, so this is done whether or not this process
+        wrote anything.
+        """
+        OPEN_STORES.pop((str(self.path), self.ext), None)
+        if not self.path.exists():
+            return
+
+        conn = self.connection
+        self.merge_chunks()
+        with conn:
+            conn.execute(
+                'DELETE FROM images WHERE tile_id NOT IN '
+                '(SELECT tile_id FROM map);')
+        conn.close()
+        self.conn = None
+
+
+def tms_key(tile):
+    """(zoom_level, tile_column, tile_row) of tile; MBTiles rows are TMS"""
+    return tile.z, tile.x, (1 << tile.z) - 1 - tile.y
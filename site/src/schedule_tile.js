@@ -19,3 +19,61 @@ ScheduleTile.write = function (obj, pbf) {
     if (obj.startIndices) pbf.writePackedVarint(3, obj.startIndices);
     if (obj.length) pbf.writeVarintField(4, obj.length);
 };
+
+// ScheduleTileV3 ========================================
+
+var ScheduleTileV3 = exports.ScheduleTileV3 = {};
+
+ScheduleTileV3.read = function (pbf, end) {
+    return pbf.readFields(ScheduleTileV3._readField, {z: 0, x: 0, y: 0, extent: 4096, positions: [], timestamps: [], startIndices: [], length: 0}, end);
+};
+ScheduleTileV3._readField = function (tag, obj, pbf) {
+    if (tag === 1) obj.z = pbf.readVarint();
+    else if (tag === 2) obj.x = pbf.readVarint();
+    else if (tag === 3) obj.y = pbf.readVarint();
+    else if (tag === 4) obj.extent = pbf.readVarint();
+    else if (tag === 5) pbf.readPackedSVarint(obj.positions);
+    else if (tag === 6) pbf.readPackedSVarint(obj.timestamps);
+    else if (tag === 7) pbf.readPackedVarint(obj.startIndices);
+    else if (tag === 8) obj.length = pbf.readVarint();
+};
+ScheduleTileV3.write = function (obj, pbf) {
+    if (obj.z) pbf.writeVarintField(1, obj.z);
+    if (obj.x) pbf.writeVarintField(2, obj.x);
+    if (obj.y) pbf.writeVarintField(3, obj.y);
+    if (obj.extent != undefined && obj.extent !== 4096) pbf.writeVarintField(4, obj.extent);
+    if (obj.positions) pbf.writePackedSVarint(5, obj.positions);
+    if (obj.timestamps) pbf.writePackedSVarint(6, obj.timestamps);
+    if (obj.startIndices) pbf.writePackedVarint(7, obj.startIndices);
+    if (obj.length) pbf.writeVarintField(8, obj.length);
+};
+
+// Not generated by pbf ========================================
+
+// Decode a ScheduleTileV3 object, as returned by ScheduleTileV3.read, into the
+// layout of ScheduleTile: absolute longitude, latitude positions and
+// timestamps in seconds, as Float32Arrays that can be passed directly to
+// deck.gl's TripsLayer.
+var decodeScheduleTileV3 = exports.decodeScheduleTileV3 = function (tile) {
+    var n = tile.length;
+    var positions = new Float32Array(2 * n);
+    var timestamps = new Float32Array(n);
+    var size = Math.pow(2, tile.z);
+    var x = 0;
+    var y = 0;
+    var t = 0;
+    for (var i = 0; i < n; i++) {
+        x += tile.positions[2 * i];
+        y += tile.positions[2 * i + 1];
+        t += tile.timestamps[i];
+
+        // Tile units to web mercator in [0, 1], then to degrees
+        var mx = (tile.x + x / tile.extent) / size;
+        var my = (tile.y + y / tile.extent) / size;
+        positions[2 * i] = mx * 360 - 180;
+        positions[2 * i + 1] = 360 / Math.PI * Math.atan(Math.exp(Math.PI * (1 - 2 * my))) - 90;
+        timestamps[i] = t / 10;
+    }
+
+    return {positions: positions, timestamps: timestamps, startIndices: tile.startIndices, length: n};
+};
@@ -0,0 +1,88 @@
+"""Check that select_ssp.py queries are answered with an index
+
+Builds empty ScheduleStopPairs tables in memory both ways the README creates
+them, and asserts that EXPLAIN QUERY PLAN never scans the whole table.
+"""
+import itertools
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+CODE_DIR = Path(__file__).resolve().parents[1] / 'code'
+sys.path.insert(0, str(CODE_DIR / 'schedules'))
+sys.path.insert(0, str(CODE_DIR / 'ssp'))
+
+import import_ssp  # noqa: E402
+import select_ssp  # noqa: E402
+
+DERIVED_COLUMNS = [
+    'origin_departure_seconds', 'service_start_julian', 'service_end_julian',
+    'service_days_of_week_mask']
+
+
+def create_imported_db():
+    """Table created by import_ssp.py"""
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(import_ssp.CREATE_TABLE_PATH.read_text())
+    conn.executescript(import_ssp.INDEX_SQL)
+    return conn
+
+
+def create_csv_db():
+    """Table imported from csv, with ssp_derived_columns.sql run afterwards"""
+    lines = [
+        line for line in import_ssp.CREATE_TABLE_PATH.read_text().splitlines()
+        if line.strip().split(' ')[0] not in DERIVED_COLUMNS]
+    create_sql = '\n'.join(lines).replace(
+        'service_days_of_week_6 INT,', 'service_days_of_week_6 INT')
+
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(create_sql)
+    conn.executescript(
+        (CODE_DIR / 'ssp' / 'ssp_derived_columns.sql').read_text())
+    return conn
+
+
+ROUTE_IDS = [['r-9q9-1'], ['r-9q9-1', 'r-9q9-2']]
+HOURS = [None, [16], [16, 20]]
+DAYS = [None, [4], [5, 6]]
+DATES = [None, '2020-02-07']
+
+
+@pytest.mark.parametrize('create_db', [create_imported_db, create_csv_db])
+def test_queries_use_index(create_db):
+    conn = create_db()
+    for route_id, hours, days, date in itertools.product(
+            ROUTE_IDS, HOURS, DAYS, DATES):
+        query_str, params = select_ssp.generate_query(
+            table_name='ssp',
+            origin_departure_hour=hours,
+            service_days_of_week=days,
+            service_date=date,
+            route_id=route_id,
+            columns=['trip'])
+        plan = select_ssp.explain_query(conn, query_str, params)
+        assert select_ssp.uses_index(plan, 'ssp'), (query_str, plan)
+
+
+def test_uses_index_detects_scan():
+    conn = create_imported_db()
+    query_str, params = select_ssp.generate_query(
+        table_name='ssp', service_days_of_week=[4])
+    plan = select_ssp.explain_query(conn, query_str, params)
+    assert not select_ssp.uses_index(plan, 'ssp')
+
+
+@pytest.mark.parametrize(
+    'detail, expected', [
+        ('SCAN ssp', False),
+        ('SCAN TABLE ssp', False),
+        ('SCAN ssp USING INDEX route_onestop_id_departure_idx', True),
+        ('SEARCH TABLE ssp USING INDEX route_onestop_id_departure_idx '
+         '(route_onestop_id=?)', True),
+        ('SCAN ssp_other', True),
+    ])
+def test_uses_index_plan_formats(detail, expected):
+    assert select_ssp.uses_index([detail], 'ssp') == expected